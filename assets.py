@@ -0,0 +1,107 @@
+from functools import lru_cache
+from typing import Set
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "static"
+STATIC_URL = "/static"
+MANIFEST = "manifest.json"
+HASHED_RE = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+COMPRESSIBLE = {".css", ".js", ".mjs", ".map", ".json", ".svg", ".txt", ".xml", ".html", ".ico", ".ttf", ".otf", ".eot"}
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+MIN_COMPRESS_SIZE = 512
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def hashed_name(path: str, data: bytes):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.md5(data).hexdigest()[:12]}{ext}"
+
+
+def write_compressed(path: str, data: bytes):
+    if os.path.splitext(path)[1] not in COMPRESSIBLE or len(data) < MIN_COMPRESS_SIZE:
+        return
+
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+
+    for encoding, compressed in variants.items():
+        # a variant that does not save anything is just extra bytes to read
+        if len(compressed) < len(data):
+            with open(path + COMPRESSED_SUFFIXES[encoding], "wb") as f:
+                f.write(compressed)
+
+
+# Writes a content-hashed copy of every asset under static/, gzip (and brotli, when installed)
+# variants next to compressible ones, and static/manifest.json mapping original names to hashed ones.
+def build(static_dir: str = STATIC_DIR):
+    manifest = {}
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if name == MANIFEST or HASHED_RE.search(name) or name.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+                continue
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            target = hashed_name(path, data)
+            if not os.path.exists(target):
+                with open(target, "wb") as f:
+                    f.write(data)
+
+            write_compressed(path, data)
+            write_compressed(target, data)
+            manifest[os.path.relpath(path, static_dir)] = os.path.relpath(target, static_dir)
+
+    with open(os.path.join(static_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+@lru_cache(maxsize=None)
+def load_manifest():
+    try:
+        with open(os.path.join(STATIC_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# template global: the hashed URL when the asset was built, the plain one otherwise
+def asset_url(path: str):
+    path = path.lstrip("/")
+    return f"{STATIC_URL}/{load_manifest().get(path, path)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--static-dir", default=STATIC_DIR)
+    manifest = build(parser.parse_args().static_dir)
+    print(f"hashed {len(manifest)} assets" + ("" if brotli else ", brotli not installed so gzip only"))
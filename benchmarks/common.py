@@ -0,0 +1,69 @@
+"""
+Helpers shared by the benchmark scripts: percentiles, the SQLite stand-ins for
+the MySQL spatial functions, and synthetic local_stores rows.
+"""
+import re
+import sys
+from datetime import datetime
+from sqlalchemy import event
+from app import models, util
+from app.db import async_engine, engine
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    def point(x, y):
+        return f"{x} {y}"
+
+    def distance_sphere(a, b):
+        if a is None or b is None or "None" in a or "None" in b:
+            return None
+        (lng1, lat1), (lng2, lat2) = [map(float, value.split()) for value in (a, b)]
+        return util.haversine_miles(lat1, lng1, lat2, lng2) * models.METERS_PER_MILE
+
+    def contains(polygon, geo):
+        if polygon is None or geo is None:
+            return 0
+        numbers = [float(value) for value in re.findall(r"-?[0-9.]+", polygon)]
+        x, y = [float(value) for value in re.findall(r"-?[0-9.]+", geo)]
+        return int(min(numbers[0::2]) <= x <= max(numbers[0::2]) and min(numbers[1::2]) <= y <= max(numbers[1::2]))
+
+    dbapi_connection.create_function("Point", 2, point)
+    dbapi_connection.create_function("ST_Distance_Sphere", 2, distance_sphere)
+    dbapi_connection.create_function("ST_Contains", 2, contains)
+    dbapi_connection.create_function("ST_GeomFromText", 1, lambda value: value)
+    dbapi_connection.create_function("ST_AsText", 1, lambda value: value)
+
+
+# on SQLite, /api/yext/search and the geo column need the spatial functions above
+def use_sqlite_functions():
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", register_sqlite_functions)
+        event.listen(async_engine.sync_engine, "connect", register_sqlite_functions)
+
+
+def local_store_row(i, name, lat=None, lng=None, **columns):
+    phone = f"212{i:07d}"
+    now = datetime.now()
+    row = {
+        "name": name, "name_normalized": util.normalize_name(name), "slug": f"bench-store-{i}",
+        "address1": f"{i} Main St", "city": "Bench", "state": "NY", "zip": "10010",
+        "phone": phone, "phone_normalized": phone, "phone_formatted": util.phone_format(phone), "country": "US",
+        "latitude": lat, "longitude": lng, "geo": f"POINT({lat} {lng})" if lat is not None else None,
+        "yext_canceled": False, "yext_suppressed": False, "show_address": True,
+        "date_created": now, "date_updated": now,
+    }
+    row.update(columns)
+    return row
+
+
+# inserts count rows built by row(i) into table, chunk rows per statement
+def seed_rows(connection, table, count, row, chunk=5000):
+    for start in range(0, count, chunk):
+        rows = [row(i) for i in range(start, min(count, start + chunk))]
+        connection.execute(table.insert(), rows)
+        print(f"seeded {start + len(rows)}/{count} {table.name}", file=sys.stderr)
@@ -0,0 +1,74 @@
+"""
+Compare request latency of the sync (threadpool + SessionLocal) and async
+(AsyncSessionLocal) database paths under concurrent load.
+
+    python -m app.benchmarks.db_paths --requests 5000 --concurrency 200 --path /
+
+Both paths run the same Page lookup against settings.database_url.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from anyio import to_thread
+from sqlalchemy import select
+from app import models
+from app.benchmarks.common import percentile
+from app.db import AsyncSessionLocal, SessionLocal
+
+
+def summarize(name, samples, elapsed):
+    return {
+        "path": name,
+        "requests": len(samples),
+        "throughput": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(samples) * 1000, 2),
+    }
+
+
+def sync_lookup(path):
+    db = SessionLocal()
+    try:
+        return db.query(models.Page).filter(models.Page.path == path).first()
+    finally:
+        db.close()
+
+
+async def async_lookup(path):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(models.Page).where(models.Page.path == path))
+        return result.scalars().first()
+
+
+async def run(name, call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return summarize(name, samples, time.perf_counter() - start)
+
+
+async def main(args):
+    results = [
+        await run("sync", lambda: to_thread.run_sync(sync_lookup, args.path), args.requests, args.concurrency),
+        await run("async", lambda: async_lookup(args.path), args.requests, args.concurrency),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--path", default="/")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""
+Benchmark /api/yext/search latlng queries against a large synthetic table.
+
+    python -m app.benchmarks.geo_search --seed 1000000
+    python -m app.benchmarks.geo_search --queries 500 --radius 10
+
+--seed inserts that many synthetic local_stores rows around US metro areas
+into settings.database_url (MySQL, with migrations/001 applied). The run
+compares the old bounding-box-only query with the indexed, distance-ordered
+LocalStore.within_radius query. Each result carries the EXPLAIN plan of its
+first query; on MySQL the indexed query should show key ix_local_stores_geo.
+"""
+import argparse
+import json
+import random
+import time
+from sqlalchemy import func, select, text
+from app.benchmarks.common import local_store_row, percentile, seed_rows, use_sqlite_functions
+from app.db import SessionLocal, engine
+from app.models import LocalStore
+
+METROS = [
+    (40.7128, -74.0060), (34.0522, -118.2437), (41.8781, -87.6298), (29.7604, -95.3698),
+    (33.4484, -112.0740), (39.9526, -75.1652), (29.4241, -98.4936), (32.7157, -117.1611),
+    (32.7767, -96.7970), (37.3382, -121.8863), (47.6062, -122.3321), (25.7617, -80.1918),
+]
+
+
+def random_point():
+    lat, lng = random.choice(METROS)
+    return round(lat + random.gauss(0, 0.5), 6), round(lng + random.gauss(0, 0.5), 6)
+
+
+def seed(count, chunk=10000):
+    def store(i):
+        lat, lng = random_point()
+        return local_store_row(i, f"Bench Store {i}", lat, lng)
+
+    with engine.begin() as connection:
+        seed_rows(connection, LocalStore.__table__, count, store, chunk)
+
+
+def legacy_query(lat, lng, radius):
+    bbox = LocalStore.get_bounding_box(lat, lng, radius)
+    polygon = 'POLYGON((%s %s,%s %s,%s %s,%s %s,%s %s))' % (
+        bbox['min_lat'], bbox['min_lng'], bbox['min_lat'], bbox['max_lng'], bbox['max_lat'], bbox['max_lng'],
+        bbox['max_lat'], bbox['min_lng'], bbox['min_lat'], bbox['min_lng'])
+    return select(LocalStore).where(func.ST_CONTAINS(func.st_GeomFromText(polygon), LocalStore._geo)).limit(30)
+
+
+def indexed_query(lat, lng, radius):
+    distance = LocalStore.distance_miles(lat, lng)
+    return (select(LocalStore, distance.label("distance_miles"))
+            .where(LocalStore.within_radius(lat, lng, radius))
+            .order_by(distance, LocalStore.id)
+            .limit(31))
+
+
+def explain(query):
+    statement = query.compile(engine, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(text(prefix + str(statement)))]
+
+
+def run(name, build, points, radius):
+    samples = []
+    rows = 0
+    db = SessionLocal()
+    try:
+        for lat, lng in points:
+            start = time.perf_counter()
+            rows += len(db.execute(build(lat, lng, radius)).all())
+            samples.append(time.perf_counter() - start)
+    finally:
+        db.close()
+
+    return {
+        "query": name,
+        "queries": len(samples),
+        "avg_rows": round(rows / len(samples), 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "plan": explain(build(*points[0], radius)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--radius", type=float, default=10)
+    args = parser.parse_args()
+
+    use_sqlite_functions()
+
+    random.seed(42)
+    if args.seed:
+        seed(args.seed)
+
+    points = [random_point() for _ in range(args.queries)]
+    print(json.dumps([
+        run("bbox_only", legacy_query, points, args.radius),
+        run("indexed_by_distance", indexed_query, points, args.radius),
+    ], indent=2, default=str))
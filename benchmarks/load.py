@@ -0,0 +1,228 @@
+"""
+Load test the main web and Yext API routes in-process at fixed concurrency.
+
+    DATABASE_URL=sqlite:///bench.sqlite python -m app.benchmarks.load --seed --stores 20000
+    python -m app.benchmarks.load --concurrency 32 --requests 500 --output baseline.json
+    python -m app.benchmarks.load --baseline baseline.json --threshold 0.15
+
+Run from the project root so templates, static and resources/public resolve.
+--seed creates the schema and inserts synthetic pages, cities, local stores,
+online stores and chains into settings.database_url. On SQLite the MySQL
+spatial functions used by /api/yext/search are registered as Python functions.
+
+Requests go through httpx's ASGI transport, no sockets involved. The report is
+JSON with throughput and latency percentiles per scenario. With --baseline a
+scenario regresses when its p50 or p99 grows, or its throughput drops, by more
+than --threshold; regressions are listed and the exit status is 1.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+import httpx
+from datetime import datetime
+from app import models
+from app.benchmarks.common import local_store_row, percentile, seed_rows, use_sqlite_functions
+from app.db import Base, engine
+from app.main import app
+
+STATES = [("NY", "New York", 40.7128, -74.0060), ("CA", "California", 34.0522, -118.2437),
+          ("IL", "Illinois", 41.8781, -87.6298), ("TX", "Texas", 29.7604, -95.3698),
+          ("FL", "Florida", 25.7617, -80.1918), ("WA", "Washington", 47.6062, -122.3321)]
+WORDS = ["pizza", "coffee", "deli", "bakery", "salon", "hardware", "books", "flowers", "tacos", "sushi"]
+STATIC_PAGES = ["/terms-and-conditions", "/privacy-policy", "/about", "/contact"]
+
+
+def city_slug(i, state_code):
+    return f"bench-city-{i}-{state_code.lower()}"
+
+
+def store_slug(i):
+    return f"bench-store-{i}"
+
+
+def seed(cities, stores, online_stores, chains, chunk=5000):
+    Base.metadata.create_all(engine)
+    now = datetime.now()
+
+    pages = [{"path": path, "title": f"Bench {path}", "content": "<p>{{ city.name if city else '' }}</p>"}
+             for path in ["/", "/city/{slug}", "/cities/{state_code}", "/stores/local/{slug}",
+                          "/stores/online/{slug}", "/stores/chain/{slug}", "/search"] + STATIC_PAGES]
+
+    city_rows = []
+    for i in range(cities):
+        state_code, state, lat, lng = STATES[i % len(STATES)]
+        city_rows.append({
+            "slug": city_slug(i, state_code), "name": f"Bench City {i}", "state": state, "state_code": state_code,
+            "zip": f"{10000 + i}", "county": "Bench", "country_code": "US",
+            "latitude": lat + random.gauss(0, 1), "longitude": lng + random.gauss(0, 1),
+            "date_created": now, "date_updated": now,
+        })
+
+    with engine.begin() as connection:
+        connection.execute(models.Page.__table__.insert(), pages)
+        connection.execute(models.City.__table__.insert(), city_rows)
+        connection.execute(models.OnlineStore.__table__.insert(), [
+            {"name": f"Bench Online {i}", "slug": f"bench-online-{i}", "homepage_url": f"https://online{i}.example.com",
+             "description": "Online store", "date_created": now, "date_updated": now}
+            for i in range(online_stores)])
+        connection.execute(models.Chain.__table__.insert(), [
+            {"name": f"Bench Chain {i}", "slug": f"bench-chain-{i}", "homepage_url": f"https://chain{i}.example.com",
+             "description": "Chain", "date_created": now, "date_updated": now}
+            for i in range(chains)])
+
+        def store(i):
+            state_code, _, lat, lng = STATES[i % len(STATES)]
+            name = f"{random.choice(WORDS).title()} {random.choice(WORDS).title()} {i}"
+            return local_store_row(
+                i, name, round(lat + random.gauss(0, 0.3), 6), round(lng + random.gauss(0, 0.3), 6),
+                slug=store_slug(i), description=" ".join(random.choices(WORDS, k=30)),
+                city=f"Bench City {i % max(cities, 1)}", state=state_code, yext_id=i)
+
+        seed_rows(connection, models.LocalStore.__table__, stores, store, chunk)
+
+
+def scenarios(cities, stores):
+    # yextIds must be new on every run
+    orders = itertools.count(int(time.time()) * 100000)
+
+    def order():
+        n = next(orders)
+        state_code, _, lat, lng = random.choice(STATES)
+        return {
+            "yextId": str(n),
+            "name": f"Load Order {n}",
+            "address": {"address": f"{n} Bench Ave", "city": "Bench", "visible": True, "state": state_code,
+                        "postalCode": "10010", "countryCode": "US"},
+            "phones": [{"number": {"number": "2125550000"}, "type": "MAIN"}],
+            "categories": [{"id": "1", "name": random.choice(WORDS)}],
+            "description": "Load test order",
+            "geoData": {"displayLatitude": str(lat), "displayLongitude": str(lng)},
+        }
+
+    def random_city():
+        i = random.randrange(cities)
+        return city_slug(i, STATES[i % len(STATES)][0])
+
+    def latlng():
+        _, _, lat, lng = random.choice(STATES)
+        return f"{lat + random.gauss(0, 0.2):.5f},{lng + random.gauss(0, 0.2):.5f}"
+
+    return {
+        "home": lambda: ("GET", "/", None),
+        "city": lambda: ("GET", f"/city/{random_city()}", None),
+        "local_store": lambda: ("GET", f"/stores/local/{store_slug(random.randrange(stores))}", None),
+        "catch_all": lambda: ("GET", random.choice(STATIC_PAGES), None),
+        "api_search_name": lambda: ("GET", f"/api/yext/search?name={random.choice(WORDS)}", None),
+        "api_search_phone": lambda: ("GET", f"/api/yext/search?phone=212{random.randrange(stores):07d}", None),
+        "api_search_latlng": lambda: ("GET", f"/api/yext/search?latlng={latlng()}&radius=5", None),
+        "api_order": lambda: ("POST", "/api/yext/powerlistings/order", order()),
+    }
+
+
+async def run_scenario(client, name, build, concurrency, requests):
+    samples = []
+    errors = 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) < requests:
+            method, url, body = build()
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            samples.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "scenario": name,
+        "requests": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p90_ms": round(percentile(samples, 90) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+
+async def run(selected, concurrency, requests, warmup):
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = []
+            for name, build in selected.items():
+                if warmup:
+                    await run_scenario(client, name, build, concurrency, warmup)
+                results.append(await run_scenario(client, name, build, concurrency, requests))
+                print(f"{name}: {results[-1]['rps']} req/s", file=sys.stderr)
+            return results
+    finally:
+        await app.router.shutdown()
+
+
+def compare(results, baseline, threshold):
+    baseline = {result["scenario"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if before is None:
+            continue
+
+        for key in ("p50_ms", "p99_ms"):
+            if result[key] > before[key] * (1 + threshold):
+                regressions.append(f"{result['scenario']}: {key} {before[key]} -> {result[key]}")
+        if result["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{result['scenario']}: rps {before['rps']} -> {result['rps']}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--cities", type=int, default=500)
+    parser.add_argument("--stores", type=int, default=20000)
+    parser.add_argument("--online-stores", type=int, default=500)
+    parser.add_argument("--chains", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--scenario", action="append", help="run only these scenarios, repeatable")
+    parser.add_argument("--output", help="write the report to this file as well")
+    parser.add_argument("--baseline", help="report from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    use_sqlite_functions()
+
+    random.seed(42)
+    if args.seed:
+        seed(args.cities, args.stores, args.online_stores, args.chains)
+
+    selected = scenarios(args.cities, args.stores)
+    if args.scenario:
+        selected = {name: selected[name] for name in args.scenario}
+
+    results = asyncio.run(run(selected, args.concurrency, args.requests, args.warmup))
+    report = {"concurrency": args.concurrency, "stores": args.stores, "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(results, json.load(f)["results"], args.threshold)
+
+    print(json.dumps(report, indent=2))
+    if report.get("regressions"):
+        sys.exit(1)
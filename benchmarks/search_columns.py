@@ -0,0 +1,105 @@
+"""
+Memory and latency of loading a 30-row /api/yext/search page with and without
+the deferred "full" column group (description and yext_data).
+
+    python -m app.benchmarks.search_columns --seed 20000
+    python -m app.benchmarks.search_columns --queries 200
+
+--seed inserts that many synthetic local_stores rows, each with a realistic
+yext_data payload, into settings.database_url. Each query is a name-prefix
+search like /api/yext/search?name=..., run once loading every column and once
+with LocalStore.summary_options().
+"""
+import argparse
+import json
+import random
+import string
+import time
+import tracemalloc
+from sqlalchemy import select
+from app.benchmarks.common import local_store_row, percentile, seed_rows, use_sqlite_functions
+from app.db import SessionLocal, engine
+from app.models import LocalStore
+from app.schemas.yext import YextCategory, YextData, YextImage, YextPhone, YextPhoneNumber, YextUrl
+
+LIMIT = 30
+
+
+def yext_payload(i):
+    return YextData(
+        images=[YextImage(url=f"https://images.example.com/{i}/{n}.jpg", type="GALLERY") for n in range(12)]
+        + [YextImage(url=f"https://images.example.com/{i}/logo.png", type="LOGO")],
+        categories=[YextCategory(id=str(n), name=f"Category {n}") for n in range(5)],
+        payment_options=["VISA", "MASTERCARD", "AMEX", "CASH"],
+        urls=[YextUrl(url=f"https://store{i}.example.com", type="WEBSITE")],
+        phones=[YextPhone(number=YextPhoneNumber(number="2125550000"), type="MAIN")],
+    )
+
+
+def seed(count, chunk=2000):
+    def store(i):
+        name = f"{random.choice(string.ascii_lowercase)}{random.choice(string.ascii_lowercase)} Bench Store {i}"
+        yext_data = yext_payload(i)
+        return local_store_row(
+            i, name, slug=f"bench-columns-{i}", description="Lorem ipsum dolor sit amet. " * 40,
+            yext_data=yext_data.dict(), logo_url=yext_data.logo_url,
+            categories=[c.dict() for c in yext_data.categories])
+
+    with engine.begin() as connection:
+        seed_rows(connection, LocalStore.__table__, count, store, chunk)
+
+
+def search_query(prefix, options):
+    return (select(LocalStore)
+            .where(LocalStore.name_normalized.startswith(prefix, autoescape=True))
+            .options(*options)
+            .order_by(LocalStore.id)
+            .limit(LIMIT))
+
+
+def run(name, options, prefixes):
+    samples = []
+    peaks = []
+    rows = 0
+    for prefix in prefixes:
+        db = SessionLocal()
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            stores = db.execute(search_query(prefix, options)).scalars().all()
+            for store in stores:
+                store.categories, store.image_url, store.description
+            samples.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            rows += len(stores)
+        finally:
+            db.close()
+
+    return {
+        "load": name,
+        "queries": len(samples),
+        "avg_rows": round(rows / len(samples), 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "peak_kib_p50": round(percentile(peaks, 50) / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    use_sqlite_functions()
+
+    random.seed(42)
+    if args.seed:
+        seed(args.seed)
+
+    prefixes = [random.choice(string.ascii_lowercase) for _ in range(args.queries)]
+    print(json.dumps([
+        run("all_columns", LocalStore.full_options(), prefixes),
+        run("summary", LocalStore.summary_options(), prefixes),
+    ], indent=2))
@@ -0,0 +1,76 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import List, NamedTuple, Optional
+from sqlalchemy.orm import Session
+from app import models
+from app.db import SessionLocal
+from threading import Lock
+
+
+class CityRecord(NamedTuple):
+    id: int
+    slug: str
+    name: str
+    state: str
+    zip: str
+    county: str
+    state_code: str
+    country_code: str
+    latitude: float
+    longitude: float
+
+
+# read-only snapshot of the cities table, sorted by slug and indexed by state_code
+class CityDirectory:
+    def __init__(self):
+        self._data = None
+        self._lock = Lock()
+
+    def load(self, db: Session):
+        columns = [getattr(models.City, name) for name in CityRecord._fields]
+        records = tuple(CityRecord(*row) for row in db.query(*columns).order_by(models.City.slug))
+        slugs = tuple(record.slug for record in records)
+
+        by_state = sorted(range(len(records)), key=lambda i: (records[i].state_code or "", records[i].name or ""))
+        state_codes = tuple(records[i].state_code or "" for i in by_state)
+
+        self._data = (slugs, records, state_codes, array("I", by_state))
+
+    def refresh(self):
+        db = SessionLocal()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def _snapshot(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self.refresh()
+
+        return self._data
+
+    def get(self, slug: str) -> Optional[CityRecord]:
+        slugs, records, _, _ = self._snapshot()
+        i = bisect_left(slugs, slug)
+        if i < len(slugs) and slugs[i] == slug:
+            return records[i]
+
+        return None
+
+    def by_state(self, state_code: str) -> List[CityRecord]:
+        _, records, state_codes, by_state = self._snapshot()
+        start = bisect_left(state_codes, state_code)
+        end = bisect_right(state_codes, state_code, lo=start)
+
+        return [records[i] for i in by_state[start:end]]
+
+    def __iter__(self):
+        return iter(self._snapshot()[1])
+
+    def __len__(self):
+        return len(self._snapshot()[1])
+
+
+city_directory = CityDirectory()
@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional, Tuple
+from app.assets import accepted_encodings
+from app.settings import settings
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SKIP_STATUSES = {204, 206, 304}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+# compressible by type and not already encoded
+def is_compressible(headers: List[Tuple[bytes, bytes]]):
+    if header(headers, b"content-encoding") is not None:
+        return False
+
+    content_type = (header(headers, b"content-type") or b"").split(b";")[0].strip().decode("latin-1").lower()
+    return content_type in settings.compression_types
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.compression_brotli_quality)
+
+    return gzip.compress(body, compresslevel=settings.compression_level, mtime=0)
+
+
+def compressed_variants(headers: List[Tuple[bytes, bytes]], body: bytes) -> Dict[str, bytes]:
+    if not settings.compression_enabled or len(body) < settings.compression_min_size or not is_compressible(headers):
+        return {}
+
+    return {encoding: compress(body, encoding) for encoding in available_encodings()}
+
+
+def encoded_headers(headers: List[Tuple[bytes, bytes]], encoding: str, length: Optional[int]):
+    headers = [(k, v) for k, v in headers if k.lower() not in (b"content-length", b"content-encoding")]
+    headers.append((b"content-encoding", encoding.encode()))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    return headers
+
+
+def with_vary(headers: List[Tuple[bytes, bytes]]):
+    vary = header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+
+    return [(k, v) for k, v in headers if k.lower() != b"vary"] + [(b"vary", vary + b", Accept-Encoding")]
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(settings.compression_level, zlib.DEFLATED, 31)
+
+    # flushes every chunk so streamed pages still reach the client piece by piece
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+
+        return self._compressor.flush()
+
+
+# gzip/brotli for responses of an allowed content type above compression_min_size. Responses that
+# already carry a Content-Encoding, like precompressed static files and response cache variants,
+# pass through untouched.
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.compression_enabled:
+            return await self.app(scope, receive, send)
+
+        accept_encoding = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding)
+
+        start = None
+        compressor = None
+
+        async def compressing_send(message):
+            nonlocal start, compressor
+
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if message["status"] in SKIP_STATUSES or not is_compressible(headers):
+                    return await send(message)
+
+                headers = with_vary(headers)
+                if encoding is None:
+                    return await send({**message, "headers": headers})
+
+                start = {**message, "headers": headers}
+                return
+
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body:
+                    start_message, start = start, None
+                    if len(body) < settings.compression_min_size:
+                        await send(start_message)
+                        return await send(message)
+
+                    body = compress(body, encoding)
+                    await send({**start_message, "headers": encoded_headers(start_message["headers"], encoding, len(body))})
+                    return await send({**message, "body": body})
+
+                compressor = StreamCompressor(encoding)
+                await send({**start, "headers": encoded_headers(start["headers"], encoding, None)})
+
+            if more_body:
+                await send({**message, "body": compressor.compress(body)})
+            else:
+                await send({**message, "body": compressor.compress(body) + compressor.finish()})
+
+        await self.app(scope, receive, compressing_send)
@@ -1,23 +1,185 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.sql import Delete, Insert, Update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.settings import settings
-from typing import Callable, TypeVar, Type
+from app import metrics
+from typing import Callable, List, Optional, TypeVar, Type
+import itertools
+import logging
+import time
 
 
 T = TypeVar('T')
 
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+pool_wait_seconds = metrics.Histogram("db_pool_wait_seconds", "Time spent waiting to check out a pooled connection")
+
+
+class TimedQueuePool(QueuePool):
+    pool_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - start, pool=self.pool_name)
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    pool_name = "async"
+
+
+def pool_options():
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = make_url(url)
+        self.engine = create_engine(url, poolclass=TimedQueuePool, **pool_options())
+        self.async_engine = create_async_engine(get_async_url(url), poolclass=TimedAsyncQueuePool, **pool_options())
+        self.healthy = True
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception:
+            if self.healthy:
+                logger.warning("Read replica %s failed its health check", self.url.host, exc_info=True)
+            self.healthy = False
+        else:
+            self.healthy = True
+
+
+class ReplicaSet:
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self._counter = itertools.count()
+
+    def choose(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+
+        return healthy[next(self._counter) % len(healthy)]
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+
 SQLALCHEMY_DATABASE_URL = settings.database_url
+SQLALCHEMY_ASYNC_DATABASE_URL = settings.async_database_url or get_async_url(settings.database_url)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=TimedQueuePool, **pool_options())
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=TimedAsyncQueuePool, **pool_options())
+replicas = ReplicaSet(settings.database_replica_urls)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=25, max_overflow=5)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Sends reads to one round-robin replica per session. Writes, and everything
+# after the first write, go to the primary so the request reads its own writes.
+class RoutingSession(Session):
+    def __init__(self, *args, use_primary: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.use_primary = use_primary
+        self._replica = None
+
+    def primary_bind(self):
+        return engine
+
+    def replica_bind(self, replica: Replica):
+        return replica.engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if isinstance(clause, (Insert, Update, Delete)):
+            self.use_primary = True
+
+        if self.use_primary or self._flushing:
+            return self.primary_bind()
+
+        if self._replica is None or not self._replica.healthy:
+            self._replica = replicas.choose()
+
+        if self._replica is None:
+            return self.primary_bind()
+
+        return self.replica_bind(self._replica)
+
+
+class AsyncRoutingSession(RoutingSession):
+    def primary_bind(self):
+        return async_engine.sync_engine
+
+    def replica_bind(self, replica: Replica):
+        return replica.async_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def pin_to_primary(session: RoutingSession, flush_context):
+    session.use_primary = True
+
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, class_=RoutingSession)
+AsyncSessionLocal = sessionmaker(
+    autoflush=False, class_=AsyncSession, sync_session_class=AsyncRoutingSession, expire_on_commit=False)
 
 Base = declarative_base()
 
 
+# read-write dependency, pinned to the primary
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(use_primary=True)
     try:
         yield db
     finally:
         db.close()
+
+
+# read-only dependency, routed to the replicas
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_gauge(fn):
+    pools = {"sync": engine.pool, "async": async_engine.sync_engine.pool}
+    for i, replica in enumerate(replicas.replicas):
+        pools[f"replica{i}"] = replica.engine.pool
+        pools[f"replica{i}_async"] = replica.async_engine.sync_engine.pool
+
+    return lambda: {(("pool", name),): fn(pool) for name, pool in pools.items()}
+
+
+metrics.Gauge("db_pool_size", "Configured pool size", pool_gauge(lambda pool: pool.size()))
+metrics.Gauge("db_pool_checked_out", "Connections currently checked out", pool_gauge(lambda pool: pool.checkedout()))
+metrics.Gauge("db_pool_overflow", "Overflow connections in use", pool_gauge(lambda pool: max(0, pool.overflow())))
+metrics.Gauge("db_replica_healthy", "1 if the read replica passed its last health check",
+              lambda: {(("replica", str(i)),): int(replica.healthy) for i, replica in enumerate(replicas.replicas)})
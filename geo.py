@@ -9,10 +9,12 @@ class GeoLocation(BaseModel):
     city: str = "New York"
     state_code: str = "NY"
     zip: str = "10010"
+    # False for the New York fallback, when nothing tells us where the visitor is
+    known: bool = False
 
 
 def get_geo_from_city(city: City):
-    return GeoLocation(city=city.name, state_code=city.state_code, state=city.zip)
+    return GeoLocation(city=city.name, state_code=city.state_code, state=city.zip, known=True)
 
 
 def get_geo(request: Request, city: City = None) -> GeoLocation:
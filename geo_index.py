@@ -0,0 +1,193 @@
+from collections import defaultdict
+from threading import Lock
+from typing import List, Tuple
+from sqlalchemy.orm import Session
+from app.db import SessionLocal
+from app.models import LocalStore
+from app.settings import settings
+from app.util import EARTH_RADIUS_MILES
+import math
+
+# numpy is optional and slow to import, it is only pulled in when the index is loaded
+np = None
+
+MILES_PER_DEGREE = 69.172
+
+
+def import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("numpy is required for the in-memory geo index")
+        np = numpy
+
+
+class Bucket:
+    def __init__(self):
+        self.points = {}
+        self._arrays = None
+
+    def put(self, store_id: int, lat: float, lng: float):
+        self.points[store_id] = (lat, lng)
+        self._arrays = None
+
+    def remove(self, store_id: int):
+        if self.points.pop(store_id, None) is not None:
+            self._arrays = None
+
+    def arrays(self):
+        if self._arrays is None:
+            ids = np.fromiter(self.points.keys(), dtype=np.int64, count=len(self.points))
+            coords = np.radians(np.array(list(self.points.values()), dtype=np.float64).reshape(-1, 2))
+            self._arrays = (ids, coords[:, 0], coords[:, 1])
+        return self._arrays
+
+
+# Grid of lat/lng cells, each holding NumPy arrays of the stores inside it.
+# Answers radius and k-nearest queries for listed stores without a database round-trip.
+class StoreGeoIndex:
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        self.ready = False
+        self._buckets = defaultdict(Bucket)
+        self._cells = {}
+        self._lock = Lock()
+
+    def cell(self, lat: float, lng: float):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def load(self, db: Session):
+        import_numpy()
+
+        q = (db.query(LocalStore.id, LocalStore._latitude, LocalStore._longitude)
+             .filter(LocalStore.listed_filter(),
+                     LocalStore._latitude.isnot(None),
+                     LocalStore._longitude.isnot(None))
+             .yield_per(10000))
+
+        buckets = defaultdict(Bucket)
+        cells = {}
+        for store_id, lat, lng in q:
+            lat, lng = float(lat), float(lng)
+            cells[store_id] = self.cell(lat, lng)
+            buckets[cells[store_id]].put(store_id, lat, lng)
+
+        with self._lock:
+            self._buckets, self._cells = buckets, cells
+            self.ready = True
+
+    def refresh(self):
+        db = SessionLocal()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def put(self, store_id: int, lat: float, lng: float):
+        with self._lock:
+            self._remove(store_id)
+            self._cells[store_id] = self.cell(lat, lng)
+            self._buckets[self._cells[store_id]].put(store_id, lat, lng)
+
+    def remove(self, store_id: int):
+        with self._lock:
+            self._remove(store_id)
+
+    def _remove(self, store_id: int):
+        cell = self._cells.pop(store_id, None)
+        if cell is not None:
+            self._buckets[cell].remove(store_id)
+
+    def update_store(self, store: LocalStore):
+        if store.id is None:
+            return
+
+        if not store.listed or store._latitude is None or store._longitude is None:
+            self.remove(store.id)
+        else:
+            self.put(store.id, float(store._latitude), float(store._longitude))
+
+    def _ring(self, center, radius: int):
+        lat_cell, lng_cell = center
+        for i in range(-radius, radius + 1):
+            for j in range(-radius, radius + 1):
+                if max(abs(i), abs(j)) == radius:
+                    yield (lat_cell + i, lng_cell + j)
+
+    def _distances(self, lat: float, lng: float, cells):
+        ids, lats, lngs = [], [], []
+        with self._lock:
+            for cell in cells:
+                bucket = self._buckets.get(cell)
+                if bucket and bucket.points:
+                    bucket_ids, bucket_lats, bucket_lngs = bucket.arrays()
+                    ids.append(bucket_ids)
+                    lats.append(bucket_lats)
+                    lngs.append(bucket_lngs)
+
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        lats, lngs = np.concatenate(lats), np.concatenate(lngs)
+        lat0, lng0 = math.radians(lat), math.radians(lng)
+        a = np.sin((lats - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lats) * np.sin((lngs - lng0) / 2) ** 2
+        return np.concatenate(ids), 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+    def _cell_miles(self, lat: float, rings: int):
+        # narrowest cell width within `rings` cells of lat, used as a lower bound on distance per ring
+        widest_lat = min(89.0, abs(lat) + (rings + 1) * self.cell_degrees)
+        return self.cell_degrees * MILES_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+    def within(self, lat: float, lng: float, radius_miles: float) -> List[Tuple[float, int]]:
+        center = self.cell(lat, lng)
+        rings = 0
+        while rings * self._cell_miles(lat, rings) < radius_miles:
+            rings += 1
+
+        cells = [cell for ring in range(rings + 1) for cell in self._ring(center, ring)]
+        ids, distances = self._distances(lat, lng, cells)
+        mask = distances <= radius_miles
+        order = np.lexsort((ids[mask], distances[mask]))
+
+        return [(float(d), int(i)) for d, i in zip(distances[mask][order], ids[mask][order])]
+
+    def nearest(self, lat: float, lng: float, k: int, max_radius_miles: float = None) -> List[Tuple[float, int]]:
+        center = self.cell(lat, lng)
+
+        # only rings that hold stores are visited, so the search ends at the edge of the data
+        rings = defaultdict(list)
+        with self._lock:
+            for cell, bucket in self._buckets.items():
+                if bucket.points:
+                    rings[max(abs(cell[0] - center[0]), abs(cell[1] - center[1]))].append(cell)
+
+        # the k best so far (plus ties), so each ring costs its own size rather than the whole index
+        ids, distances = np.empty(0, dtype=np.int64), np.empty(0)
+        for ring in sorted(rings):
+            # anything in this ring or beyond is at least this far away
+            reach = (ring - 1) * self._cell_miles(lat, ring - 1) if ring else 0
+            if max_radius_miles is not None and reach > max_radius_miles:
+                break
+            if len(ids) >= k and distances.max() <= reach:
+                break
+
+            ring_ids, ring_distances = self._distances(lat, lng, rings[ring])
+            if max_radius_miles is not None:
+                mask = ring_distances <= max_radius_miles
+                ring_ids, ring_distances = ring_ids[mask], ring_distances[mask]
+
+            ids, distances = np.concatenate((ids, ring_ids)), np.concatenate((distances, ring_distances))
+            if len(ids) > k:
+                keep = distances <= np.partition(distances, k - 1)[k - 1]
+                ids, distances = ids[keep], distances[keep]
+
+        order = np.lexsort((ids, distances))[:k]
+        return [(float(distances[i]), int(ids[i])) for i in order]
+
+    def __len__(self):
+        return len(self._cells)
+
+
+geo_index = StoreGeoIndex(cell_degrees=settings.geo_index_cell_degrees)
@@ -1,13 +1,25 @@
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlalchemy.exc import NoResultFound
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+from mimetypes import guess_type
 from app.routes import web, api_yext
+from app.cities import city_directory
+from app.db import replicas
+from app.geo_index import geo_index
+from app.public_files import public_files
+from app.search import search_index
+from app.settings import settings
+from app.compression import CompressionMiddleware
+from app.timing import TimingMiddleware
+from app import assets, metrics, models, pages, util
 import anyio
+import os
 
 API_PREFIX = "/api"
-THREADS_LIMIT = 100
 
 
 class CustomStaticFiles(StaticFiles):
@@ -18,19 +30,114 @@ class CustomStaticFiles(StaticFiles):
         scope,
         status_code: int = 200,
     ):
-        response = super().file_response(full_path, stat_result, scope, status_code)
-        response.headers['cache-control'] = "public, max-age=86400"
+        request_headers = Headers(scope=scope)
+        response = None
+
+        # serve a variant written by `python -m app.assets` when the client accepts it
+        accepted = assets.accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding not in accepted:
+                continue
+            try:
+                variant_stat = os.stat(str(full_path) + assets.COMPRESSED_SUFFIXES[encoding])
+            except FileNotFoundError:
+                continue
+
+            response = FileResponse(
+                str(full_path) + assets.COMPRESSED_SUFFIXES[encoding], status_code=status_code,
+                stat_result=variant_stat, method=scope["method"], media_type=guess_type(str(full_path))[0])
+            response.headers["content-encoding"] = encoding
+            break
+
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, method=scope["method"])
+
+        response.headers["vary"] = "Accept-Encoding"
+        if assets.HASHED_RE.search(str(full_path)):
+            response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["cache-control"] = "public, max-age=86400"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
         return response
 
 
+def thread_limiter():
+    return anyio.to_thread.current_default_thread_limiter()
+
+
+metrics.Gauge("threadpool_limit", "AnyIO worker thread limit", lambda: thread_limiter().total_tokens)
+metrics.Gauge("threadpool_busy", "AnyIO worker threads in use", lambda: thread_limiter().borrowed_tokens)
+metrics.Gauge("threadpool_queue_depth", "Tasks waiting for an AnyIO worker thread",
+              lambda: thread_limiter().statistics().tasks_waiting)
+
+caches = {
+    "compiled_templates": web.compiled_templates,
+    "pages": pages.page_cache,
+    "unknown_paths": web.unknown_paths,
+    "yext": models.yext_cache,
+}
+
+
+def cache_stat(stat):
+    return lambda: {(("cache", name),): cache.stats()[stat] for name, cache in caches.items()}
+
+
+metrics.Gauge("cache_size", "Entries held by the in-process LRU cache", cache_stat("size"))
+metrics.Gauge("cache_maxsize", "Configured LRU cache capacity", cache_stat("maxsize"))
+metrics.CounterFunction("cache_hits_total", "LRU cache lookups that found an entry", cache_stat("hits"))
+metrics.CounterFunction("cache_misses_total", "LRU cache lookups that found nothing or an expired entry",
+                        cache_stat("misses"))
+
 app = FastAPI(docs_url=None, redoc_url=None)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(TimingMiddleware)
 
-app.mount("/static", CustomStaticFiles(directory="static"), name="static")
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+app.mount(assets.STATIC_URL, CustomStaticFiles(directory=assets.STATIC_DIR), name="static")
 app.mount("/api/yext", api_yext.app, name="api_yext")
 app.mount("/", web.app, name="web")
 
 
-# @app.on_event("startup")
-# def startup():
-#     limiter = anyio.to_thread.current_default_thread_limiter()
-#     limiter.total_tokens = THREADS_LIMIT
+@app.on_event("startup")
+def load_city_directory():
+    city_directory.refresh()
+    util.every(settings.city_refresh_interval, city_directory.refresh)
+
+
+@app.on_event("startup")
+def load_public_files():
+    public_files.refresh()
+    util.every(settings.public_files_refresh_interval, public_files.refresh)
+
+
+@app.on_event("startup")
+def load_geo_index():
+    if settings.geo_index_enabled:
+        geo_index.refresh()
+        util.every(settings.geo_index_refresh_interval, geo_index.refresh)
+
+
+@app.on_event("startup")
+def load_search_index():
+    if settings.search_index_enabled:
+        search_index.refresh()
+        util.every(settings.search_index_refresh_interval, search_index.refresh)
+
+
+@app.on_event("startup")
+def check_replicas():
+    if replicas:
+        replicas.check()
+        util.every(settings.replica_health_check_interval, replicas.check)
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    thread_limiter().total_tokens = settings.threads_limit
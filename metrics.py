@@ -0,0 +1,107 @@
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from typing import Callable, Dict, Tuple, Union
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...], extra: Dict[str, str] = None):
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ""
+
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in pairs) + "}"
+
+
+class Gauge:
+    type = "gauge"
+
+    # fn returns a number, or a dict of label tuples -> number
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, dict]]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        registry.append(self)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+
+        for labels, sample in value.items():
+            yield self.name + format_labels(labels), sample
+
+
+# a counter whose total is kept elsewhere and read through fn, like Gauge
+class CounterFunction(Gauge):
+    type = "counter"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = defaultdict(float)
+        self._lock = Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        for labels, value in values.items():
+            yield self.name + format_labels(labels), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0])
+        self._lock = Lock()
+        registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series[key]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+        for labels, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield self.name + "_bucket" + format_labels(labels, {"le": le}), cumulative
+            yield self.name + "_sum" + format_labels(labels), total
+            yield self.name + "_count" + format_labels(labels), cumulative
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
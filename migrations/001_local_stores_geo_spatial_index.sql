@@ -0,0 +1,15 @@
+-- Spatial index for /api/yext/search?latlng= (LocalStore.within_radius).
+-- MySQL only indexes NOT NULL geometry columns, so backfill geo first.
+-- MySQL 8 also ignores the index unless the column is restricted to one SRID. ST_GeomFromText
+-- without an SRID argument, used by the model and within_radius, produces SRID 0.
+
+UPDATE local_stores
+SET geo = ST_GeomFromText(CONCAT('POINT(', latitude, ' ', longitude, ')'))
+WHERE geo IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL;
+
+-- rows without coordinates never pass the distance check, their placeholder point is harmless
+UPDATE local_stores SET geo = ST_GeomFromText('POINT(0 0)') WHERE geo IS NULL;
+
+ALTER TABLE local_stores MODIFY geo POINT NOT NULL SRID 0;
+
+CREATE SPATIAL INDEX ix_local_stores_geo ON local_stores (geo);
@@ -0,0 +1,9 @@
+-- Normalized lookup columns for /api/yext/search phone and name-prefix filters.
+-- Fill existing rows afterwards with: python -m app.migrations.backfill_search_columns
+
+ALTER TABLE local_stores
+    ADD COLUMN phone_normalized VARCHAR(20) NULL,
+    ADD COLUMN name_normalized VARCHAR(255) NULL;
+
+CREATE INDEX ix_local_stores_phone_normalized ON local_stores (phone_normalized);
+CREATE INDEX ix_local_stores_name_normalized ON local_stores (name_normalized);
@@ -0,0 +1,7 @@
+-- Projections of yext_data and phone so listings and /api/yext results can skip the yext_data blob.
+-- Fill existing rows afterwards with: python -m app.migrations.backfill_projection_columns
+
+ALTER TABLE local_stores
+    ADD COLUMN logo_url VARCHAR(1024) NULL,
+    ADD COLUMN categories JSON NULL,
+    ADD COLUMN phone_formatted VARCHAR(20) NULL;
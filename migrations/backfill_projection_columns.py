@@ -0,0 +1,56 @@
+"""
+Backfill LocalStore.logo_url, categories and phone_formatted for rows written
+before migrations/003, one id range per transaction.
+
+    python -m app.migrations.backfill_projection_columns --batch-size 2000
+"""
+import argparse
+from sqlalchemy import bindparam, select, update
+from app import util
+from app.db import engine
+from app.models import LocalStore
+from app.schemas.yext import YextData
+
+
+def projections(row):
+    yext_data = YextData.from_db(row.yext_data) if row.yext_data else None
+    return {
+        "_id": row.id,
+        "_logo_url": yext_data.logo_url if yext_data else None,
+        "_categories": [category.dict() for category in yext_data.categories] if yext_data else None,
+        "_phone": util.phone_format(row.phone) if row.phone and row.phone.isdigit() else None,
+    }
+
+
+def backfill(batch_size):
+    table = LocalStore.__table__
+    statement = (update(table)
+                 .where(table.c.id == bindparam("_id"))
+                 .values(logo_url=bindparam("_logo_url"),
+                         categories=bindparam("_categories"),
+                         phone_formatted=bindparam("_phone")))
+
+    last_id = 0
+    updated = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.phone, table.c.yext_data)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            connection.execute(statement, [projections(row) for row in rows])
+
+        last_id = rows[-1].id
+        updated += len(rows)
+        print(f"backfilled {updated} rows (last id {last_id})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=2000)
+    backfill(parser.parse_args().batch_size)
@@ -0,0 +1,46 @@
+"""
+Backfill LocalStore.phone_normalized and name_normalized for rows written
+before migrations/002, one id range per transaction.
+
+    python -m app.migrations.backfill_search_columns --batch-size 5000
+"""
+import argparse
+from sqlalchemy import bindparam, select, update
+from app import util
+from app.db import engine
+from app.models import LocalStore
+
+
+def backfill(batch_size):
+    table = LocalStore.__table__
+    statement = (update(table)
+                 .where(table.c.id == bindparam("_id"))
+                 .values(phone_normalized=bindparam("_phone"), name_normalized=bindparam("_name")))
+
+    last_id = 0
+    updated = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.name, table.c.phone)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            connection.execute(statement, [
+                {"_id": row.id, "_phone": util.normalize_phone(row.phone), "_name": util.normalize_name(row.name)}
+                for row in rows
+            ])
+
+        last_id = rows[-1].id
+        updated += len(rows)
+        print(f"backfilled {updated} rows (last id {last_id})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=5000)
+    backfill(parser.parse_args().batch_size)
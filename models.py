@@ -2,19 +2,22 @@ from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, F
 from sqlalchemy.orm import relationship, Session
 from .db import Base
 import sqlalchemy.types as types
-from sqlalchemy import func
-from sqlalchemy.orm import validates
+from sqlalchemy import Index, and_, func, not_, or_
+from sqlalchemy.orm import deferred, undefer, undefer_group, validates
 from pydantic.dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 import pydantic
 from . import util
+from app.cache import LRUCache
 from urllib.parse import urlparse
-from app.schemas.yext import YextData
+from app.schemas.yext import YextCategory, YextData
 from app.settings import settings
 from sqlalchemy.ext.hybrid import hybrid_method
 import math
 
+METERS_PER_MILE = 1609.344
+
 
 class ValidationError(Exception):
     def __init__(self, field: str, message: str):
@@ -83,6 +86,7 @@ class HasGeo:
         if self._latitude and self._longitude:
             self._geo = "POINT(%s %s)" % (self._latitude, self._longitude)
 
+    @staticmethod
     def get_bounding_box(lat, lng, miles):
         return {
             "min_lat": lat - miles / 69.172,
@@ -91,9 +95,25 @@ class HasGeo:
             "max_lng": lng + miles / 69.172 / math.cos(math.radians(lat))
         }
 
+    @hybrid_method
+    def distance_miles(self, lat, lng):
+        if self._latitude is None or self._longitude is None:
+            return None
+        return util.haversine_miles(float(self._latitude), float(self._longitude), lat, lng)
+
+    @distance_miles.expression
+    def distance_miles(cls, lat, lng):
+        return func.ST_Distance_Sphere(func.Point(cls._longitude, cls._latitude), func.Point(lng, lat)) / METERS_PER_MILE
+
     @hybrid_method
     def within_radius(self, lat, lng, radius_miles):
-        bbox = self.get_bounding_box(lat, lng, radius_miles)
+        distance = self.distance_miles(lat, lng)
+        return distance is not None and distance <= radius_miles
+
+    @within_radius.expression
+    def within_radius(cls, lat, lng, radius_miles):
+        # the bounding box lets MySQL use the spatial index on geo, the distance check trims its corners
+        bbox = cls.get_bounding_box(lat, lng, radius_miles)
         polygon = 'POLYGON((%s %s,%s %s,%s %s,%s %s,%s %s))' % (
             bbox['min_lat'], bbox['min_lng'],
             bbox['min_lat'], bbox['max_lng'],
@@ -101,7 +121,10 @@ class HasGeo:
             bbox['max_lat'], bbox['min_lng'],
             bbox['min_lat'], bbox['min_lng'],
         )
-        return func.ST_CONTAINS(func.st_GeomFromText(polygon), self._geo)
+        return and_(
+            func.ST_CONTAINS(func.st_GeomFromText(polygon), cls._geo),
+            cls.distance_miles(lat, lng) <= radius_miles,
+        )
 
 
 class HasTimestamps:
@@ -162,13 +185,33 @@ class BaseStore:
         return u.hostname
 
 
+# Parsed yext_data and the values derived from it, computed once per store version
+class ParsedYext(NamedTuple):
+    data: YextData
+    logo_url: Optional[str]
+    main_phone: Optional[str]
+    website_url: Optional[str]
+    gallery_images: list
+
+    @classmethod
+    def of(cls, data: YextData):
+        return cls(data, data.logo_url, data.main_phone, data.website_url, data.gallery_images)
+
+
+# (store id, date_updated) -> ParsedYext, shared across requests
+yext_cache = LRUCache(maxsize=settings.yext_cache_size)
+
+
 class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
     __tablename__ = "local_stores"
+    __table_args__ = (
+        Index("ix_local_stores_geo", "geo", mysql_prefix="SPATIAL"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     canonical_id = Column(Integer, primary_key=False, index=True)
     name = Column(String, unique=False, index=True)
-    description = Column(String, unique=False, index=False)
+    description = deferred(Column(String, unique=False, index=False), group="full")
     slug = Column(String, unique=True, index=True)
     address1 = Column(String, unique=False, index=False)
     address2 = Column(String, unique=False, index=False)
@@ -176,6 +219,8 @@ class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
     state = Column(String, unique=False, index=False)
     zip = Column(String, unique=False, index=False)
     phone = Column(String, unique=False, index=False)
+    phone_normalized = Column(String, unique=False, index=True)
+    name_normalized = Column(String, unique=False, index=True)
     country = Column(String, unique=False, index=False)
     homepage_url = Column(String, unique=False, index=False)
     facebook_url = Column(String, unique=False, index=False)
@@ -188,13 +233,26 @@ class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
     date_deleted = Column(DateTime)
 
     _image_url = Column("image_url", String, unique=False, index=False)
-    _yext_data = Column("yext_data", JSON, unique=False, index=False)
-    _yext_data_obj = None
+    _yext_data = deferred(Column("yext_data", JSON, unique=False, index=False), group="full")
+    _parsed_yext = None
+
+    # projections of yext_data and phone, kept in sync on every write so listings can skip the blob
+    _logo_url = Column("logo_url", String, unique=False, index=False)
+    _categories = Column("categories", JSON, unique=False, index=False)
+    _phone_formatted = Column("phone_formatted", String, unique=False, index=False)
 
     @validates("name", "address1", "city", "state", "zip", "phone")
     def validate_not_empty(self, key, value):
         if not value or not isinstance(value, str) or len(value) == 0:
             raise ValidationError(key, f"{key} is required")
+
+        # lookup columns for /api/yext/search, kept in sync on every write
+        if key == "phone":
+            self.phone_normalized = util.normalize_phone(value)
+            self._phone_formatted = util.phone_format(value) if value.isdigit() else None
+        elif key == "name":
+            self.name_normalized = util.normalize_name(value)
+
         return value
 
     @staticmethod
@@ -223,36 +281,91 @@ class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
 
         return "AVAILABLE"
 
+    # SQL counterpart of status
+    @classmethod
+    def status_filter(cls, status: str):
+        not_canceled = or_(cls.yext_canceled.is_(None), cls.yext_canceled.is_(False))
+        not_suppressed = or_(cls.yext_suppressed.is_(None), cls.yext_suppressed.is_(False))
+        active = and_(cls.yext_id.isnot(None), cls.yext_id != 0, not_canceled, not_suppressed)
+
+        if status == "ACTIVE":
+            return active
+        if status == "SUPPRESSED":
+            return cls.yext_suppressed.is_(True)
+        if status == "AVAILABLE":
+            return and_(not_(active), not_suppressed)
+
+        raise ValidationError("status", "status must be ACTIVE, SUPPRESSED or AVAILABLE")
+
+    # neither deleted nor suppressed, the stores geo searches may return
     @property
-    def yext(self) -> Optional[YextData]:
-        if self._yext_data_obj:
-            return self._yext_data_obj
+    def listed(self):
+        return not self.date_deleted and not self.yext_suppressed
 
-        if not self._yext_data:
-            return None
+    @classmethod
+    def listed_filter(cls):
+        return and_(cls.date_deleted.is_(None), or_(cls.yext_suppressed.is_(None), cls.yext_suppressed.is_(False)))
 
-        self._yext_data_obj = YextData(
-            suppressed=self.yext_suppressed, canceled=self.yext_canceled, id=self.yext_id, **self._yext_data)
-        return self._yext_data_obj
+    @property
+    def parsed_yext(self) -> Optional[ParsedYext]:
+        if self._parsed_yext is None and self._yext_data:
+            key = (self.id, self.date_updated)
+            parsed = yext_cache.get(key) if self.id is not None else None
+            if parsed is None:
+                parsed = ParsedYext.of(YextData.from_db(self._yext_data))
+                if self.id is not None:
+                    yext_cache.set(key, parsed)
+            self._parsed_yext = parsed
+
+        return self._parsed_yext
+
+    @property
+    def yext(self) -> Optional[YextData]:
+        return self.parsed_yext.data if self.parsed_yext else None
 
     @yext.setter
     def yext(self, yext_data: YextData):
+        if self.id is not None:
+            # date_updated may not change within its column precision, so drop every cached version
+            yext_cache.pop_where(lambda key: key[0] == self.id)
+
         if yext_data:
-            self._yext_data_obj = yext_data
+            self._parsed_yext = ParsedYext.of(yext_data)
             self._yext_data = yext_data.dict()
+            self._logo_url = self._parsed_yext.logo_url
+            self._categories = [category.dict() for category in yext_data.categories]
         else:
-            self._yext_data_obj = None
+            self._parsed_yext = None
             self._yext_data = None
+            self._logo_url = None
+            self._categories = None
+
+    # description and yext_data are in the deferred "full" group. Listings and API results also
+    # show the description, the projection columns stand in for yext_data.
+    @classmethod
+    def summary_options(cls):
+        return [undefer(cls.description)]
+
+    # summary plus yext_data, for store cards in templates that show emails, payment options,
+    # gallery images or videos. Those would lazy load yext_data, which fails on an AsyncSession.
+    @classmethod
+    def listing_options(cls):
+        return cls.summary_options() + [undefer(cls._yext_data)]
+
+    # everything, for the store page and writes that rebuild yext_data
+    @classmethod
+    def full_options(cls):
+        return [undefer_group("full")]
 
     @property
     def image_url(self):
-        if self.yext and self.yext.logo_url:
-            return self.yext.logo_url
-
-        return self._image_url
+        return self._logo_url or self._image_url
 
     @property
     def phone_formatted(self):
+        if self._phone_formatted:
+            return self._phone_formatted
+
         if self.phone:
             return util.phone_format(self.phone)
 
@@ -267,9 +380,7 @@ class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
 
     @property
     def categories(self):
-        if self.yext and self.yext.categories:
-            return self.yext.categories
-        return []
+        return [YextCategory.construct(**category) for category in self._categories or []]
 
     @property
     def emails(self):
@@ -285,8 +396,8 @@ class LocalStore(BaseModel, HasGeo, HasTimestamps, BaseStore, Base):
 
     @property
     def gallery_images(self):
-        if self.yext and self.yext.gallery_images:
-            return self.yext.gallery_images
+        if self.parsed_yext:
+            return self.parsed_yext.gallery_images
         return []
 
     @property
@@ -0,0 +1,75 @@
+from dataclasses import dataclass, fields
+from typing import Optional
+from sqlalchemy import event, inspect, select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models
+from app.cache import LRUCache
+from app.settings import settings
+
+
+@dataclass(frozen=True)
+class PageSnapshot:
+    id: int
+    path: str
+    title: Optional[str] = None
+    meta_keywords: Optional[str] = None
+    meta_description: Optional[str] = None
+    content: Optional[str] = None
+    canonical_url: Optional[str] = None
+
+    @classmethod
+    def from_model(cls, page: models.Page):
+        return cls(**{f.name: getattr(page, f.name) for f in fields(cls)})
+
+
+# path -> PageSnapshot, or None for paths known not to have a page
+page_cache = LRUCache(maxsize=settings.page_cache_size, ttl=settings.page_cache_ttl)
+
+_MISSING = object()
+
+
+def _store(path: str, page: Optional[models.Page], cache_missing: bool) -> Optional[PageSnapshot]:
+    snapshot = PageSnapshot.from_model(page) if page else None
+    if snapshot is not None or cache_missing:
+        page_cache.set(path, snapshot)
+
+    return snapshot
+
+
+def _found(path: str, page: Optional[PageSnapshot]) -> PageSnapshot:
+    if page is None:
+        raise NoResultFound(f"No page found for path '{path}'")
+
+    return page
+
+
+# cache_missing=False for lookups of arbitrary request paths, so misses do not evict real pages
+async def find_page_async(db: AsyncSession, path: str, cache_missing: bool = True) -> Optional[PageSnapshot]:
+    snapshot = page_cache.get(path, _MISSING)
+    if snapshot is not _MISSING:
+        return snapshot
+
+    result = await db.execute(select(models.Page).where(models.Page.path == path))
+    return _store(path, result.scalars().first(), cache_missing)
+
+
+async def get_page_async(db: AsyncSession, path: str, cache_missing: bool = True) -> PageSnapshot:
+    return _found(path, await find_page_async(db, path, cache_missing))
+
+
+def invalidate(path: str = None):
+    if path is None:
+        page_cache.clear()
+    else:
+        page_cache.pop(path)
+
+
+@event.listens_for(models.Page, "after_insert")
+@event.listens_for(models.Page, "after_update")
+@event.listens_for(models.Page, "after_delete")
+def invalidate_page(mapper, connection, page: models.Page):
+    # drop the previous path too, in case the page was moved
+    invalidate(page.path)
+    for path in inspect(page).attrs.path.history.deleted or ():
+        invalidate(path)
@@ -0,0 +1,86 @@
+from email.utils import formatdate
+from mimetypes import guess_type
+from threading import Lock
+from typing import NamedTuple, Optional
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from app.settings import settings
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class PublicFile(NamedTuple):
+    path: str
+    media_type: str
+    etag: str
+    last_modified: str
+    stat: os.stat_result
+    body: Optional[bytes]
+
+
+# Snapshot of resources/public, so the catch-all route can answer robots.txt, favicons and
+# sitemaps without a database lookup. Files up to public_file_memory_limit are held in memory.
+class PublicFileIndex:
+    def __init__(self, root: str):
+        self.root = root
+        self._files = {}
+        self._lock = Lock()
+
+    def load(self):
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+
+                body = None
+                if stat.st_size <= settings.public_file_memory_limit:
+                    with open(path, "rb") as f:
+                        body = f.read()
+
+                etag = hashlib.md5(body).hexdigest() if body is not None else f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                files[key] = PublicFile(
+                    path=path,
+                    media_type=guess_type(name)[0] or "application/octet-stream",
+                    etag=f'"{etag}"',
+                    last_modified=formatdate(stat.st_mtime, usegmt=True),
+                    stat=stat,
+                    body=body,
+                )
+
+        with self._lock:
+            self._files = files
+
+    def refresh(self):
+        try:
+            self.load()
+        except OSError:
+            logger.exception("Failed to index %s", self.root)
+
+    def get(self, path: str) -> Optional[PublicFile]:
+        return self._files.get(path.lstrip("/"))
+
+    def response(self, file: PublicFile, request: Request) -> Response:
+        headers = {
+            "etag": file.etag,
+            "last-modified": file.last_modified,
+            "cache-control": f"public, max-age={settings.public_file_max_age}",
+        }
+
+        if request.headers.get("if-none-match") == file.etag:
+            return Response(status_code=304, headers=headers)
+
+        if file.body is None:
+            return FileResponse(file.path, stat_result=file.stat, media_type=file.media_type, headers=headers)
+
+        return Response(file.body, media_type=file.media_type, headers=headers)
+
+    def __len__(self):
+        return len(self._files)
+
+
+public_files = PublicFileIndex(settings.public_dir)
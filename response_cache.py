@@ -0,0 +1,258 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from starlette.requests import Request
+from app.compression import choose_encoding, compressed_variants, encoded_headers, with_vary
+from app.geo import GEO_COOKIE
+from app.settings import settings
+from app.timing import route_name
+import asyncio
+import hashlib
+import time
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+    etag: bytes
+    ttl: float
+    stale_ttl: float
+    # route template the response came from, for the timing metrics of cache hits
+    route: Optional[str] = None
+    # encoding -> compressed body, computed once when the entry is stored
+    variants: Dict[str, bytes] = field(default_factory=dict)
+    stored_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def size(self):
+        return (len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+                + sum(len(body) for body in self.variants.values()))
+
+    @property
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+    @property
+    def fresh(self):
+        return self.age < self.ttl
+
+    @property
+    def usable(self):
+        return self.age < self.ttl + self.stale_ttl
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or not entry.usable:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return entry
+
+    def set(self, key, entry: CachedResponse):
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._discard(key)
+            self._data[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= evicted.size
+
+    def purge(self, *paths: str):
+        with self._lock:
+            for key in [key for key in self._data if key[0] in paths]:
+                self._discard(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+response_cache = ResponseCache(max_bytes=settings.response_cache_max_bytes)
+
+
+# opts a route into ResponseCacheMiddleware, apply it below @app.get()
+def cache_response(ttl: float = None, stale_ttl: float = None):
+    def decorator(endpoint):
+        endpoint.response_cache = (
+            settings.response_cache_ttl if ttl is None else ttl,
+            settings.response_cache_stale_ttl if stale_ttl is None else stale_ttl,
+        )
+        return endpoint
+
+    return decorator
+
+
+def get_cache_key(request: Request):
+    return (request.url.path, str(request.query_params), request.cookies.get(GEO_COOKIE))
+
+
+def is_anonymous(request: Request):
+    return "authorization" not in request.headers
+
+
+# receive for background revalidation: an empty body once, then block like a client that
+# stays connected, so StreamingResponse's disconnect listener waits instead of spinning
+def _empty_receive():
+    sent = False
+    never = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await never.wait()
+
+    return receive
+
+
+class ResponseCacheMiddleware:
+    def __init__(self, app, cache: ResponseCache = response_cache):
+        self.app = app
+        self.cache = cache
+        self._revalidating = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        request = Request(scope)
+        if not is_anonymous(request):
+            return await self.app(scope, receive, send)
+
+        key = get_cache_key(request)
+        entry = self.cache.get(key)
+
+        if entry is None:
+            return await self._fetch(scope, receive, send, key, request)
+
+        if not entry.fresh and key not in self._revalidating:
+            self._revalidating[key] = asyncio.create_task(self._revalidate(dict(scope), key))
+
+        scope.setdefault("state", {})["cached_route"] = entry.route
+        await self._send_entry(entry, request, send, b"HIT" if entry.fresh else b"STALE")
+
+    async def _fetch(self, scope, receive, send, key, request: Request = None):
+        start = None
+        streaming = False
+        chunks = []
+
+        async def capture(message):
+            nonlocal start, streaming
+
+            if message["type"] == "http.response.start":
+                options = getattr(scope.get("endpoint"), "response_cache", None)
+                headers = dict(message.get("headers", []))
+                if options and message["status"] == 200 and b"set-cookie" not in headers:
+                    start = (message, options)
+                    return
+
+            if start is None:
+                if send:
+                    await send(message)
+                else:
+                    # revalidation got an uncacheable response, stop serving the stale one
+                    self.cache.discard(key)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body"):
+                # streamed response, pass it through while capturing, without an ETag this time
+                if send and not streaming:
+                    streaming = True
+                    headers = list(start[0].get("headers", [])) + [(b"x-cache", b"MISS")]
+                    await send({**start[0], "headers": headers})
+                if streaming:
+                    await send(message)
+                return
+
+            start_message, (ttl, stale_ttl) = start
+            body = b"".join(chunks)
+            entry = CachedResponse(
+                status=start_message["status"],
+                headers=list(start_message.get("headers", [])),
+                body=body,
+                etag=b'W/"%s"' % hashlib.md5(body).hexdigest().encode(),
+                ttl=ttl,
+                stale_ttl=stale_ttl,
+                variants=compressed_variants(list(start_message.get("headers", [])), body),
+                route=route_name(scope),
+            )
+            self.cache.set(key, entry)
+            if streaming:
+                await send(message)
+            elif send:
+                await self._send_entry(entry, request, send, b"MISS")
+
+        await self.app(scope, receive, capture)
+
+    async def _revalidate(self, scope, key):
+        try:
+            await self._fetch(scope, _empty_receive(), None, key)
+        except Exception:
+            self.cache.discard(key)
+        finally:
+            self._revalidating.pop(key, None)
+
+    async def _send_entry(self, entry: CachedResponse, request: Request, send, status: bytes):
+        headers = [(k, v) for k, v in entry.headers if k != b"etag"]
+        headers += [(b"etag", entry.etag), (b"x-cache", status)]
+
+        if_none_match = request.headers.get("if-none-match", "").encode()
+        if entry.etag in [tag.strip() for tag in if_none_match.split(b",")]:
+            headers = [(k, v) for k, v in headers if k not in (b"content-length", b"content-type")]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = entry.body
+        encoding = choose_encoding(request.headers.get("accept-encoding", "")) if entry.variants else None
+        if encoding in entry.variants:
+            body = entry.variants[encoding]
+            headers = with_vary(encoded_headers(headers, encoding, len(body)))
+
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,18 +1,29 @@
 from fastapi import Request
 from fastapi import FastAPI, APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.exc import NoResultFound
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy import and_, exists, inspect, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.schemas import yext
-from app.db import get_db
-from app import models
+from app.db import SessionLocal, get_db, get_async_db
+from app import models, util
 from app.settings import settings
 from app.models import LocalStore
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from slugify import slugify
 from datetime import datetime
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from typing import Optional
+import base64
+import json
+import pydantic
+import zlib
+from app.response_cache import response_cache
+from app.geo_index import geo_index
+from app.search import search_index
 
 app = FastAPI(docs_url=None, redoc_url=None)
 
@@ -27,13 +38,17 @@ def http_exception_handler(request, exc: NoResultFound):
 @app.exception_handler(RequestValidationError)
 @app.exception_handler(models.ValidationError)
 def validation_exception_handler(request, exc: RequestValidationError):
+    return JSONResponse(rejected(exc.errors()), 409)
+
+
+def rejected(errors, loc_offset=1):
     issues = []
-    for err in exc.errors():
+    for err in errors:
         issues.append({
             "description": err.get("msg"),
-            "field": ".".join(str(s) for s in list(err.get("loc", []))[1:])
+            "field": ".".join(str(s) for s in list(err.get("loc", []))[loc_offset:])
         })
-    return JSONResponse({"status": "REJECTED", "issues": issues}, 409)
+    return {"status": "REJECTED", "issues": issues}
 
 
 @app.exception_handler(Exception)
@@ -41,26 +56,97 @@ def http_exception_handler(request, exc: Exception):
     return JSONResponse({"error": {"message": str(exc)}}, 500)
 
 
-def generate_local_slug(db: Session, store: LocalStore):
-    base_slug = slugify(f"{store.name} {store.city} {store.zip}")
+SLUG_ATTEMPTS = 3
+BATCH_CHUNK_SIZE = 500
+DUPLICATE_YEXT_ID = "Listing with yextId already exists."
+DETAILS_CHUNK_SIZE = 500
+DETAILS_MAX_IDS = 10000
+EXPORT_BATCH_SIZE = 1000
+SEARCH_LIMIT = 30
+SEARCH_MAX_LIMIT = 100
+SEARCH_RADIUS_MILES = 10
+SEARCH_MAX_RADIUS_MILES = 100
+
+
+def slug_source(store: LocalStore):
+    return (store.name, store.city, store.zip)
+
+
+def next_free_slug(base_slug: str, taken: set):
     slug = base_slug
     index = 1
-    while db.query(LocalStore).filter((LocalStore.slug == slug) & (LocalStore.id != store.id)).count() > 0:
+    while slug in taken:
         slug = base_slug + f"-{index}"
         index += 1
 
     return slug
 
 
-@app.post("/powerlistings/order")
-def yext_listing_order(order: yext.YextListingCreate, db: Session = Depends(get_db)):
+def slug_prefix_filter(base_slug: str):
+    return (LocalStore.slug == base_slug) | LocalStore.slug.startswith(base_slug + "-", autoescape=True)
 
-    # Check if the store already exists by yextId
-    if order.yextId:
-        existing_store = db.query(LocalStore).filter(LocalStore.yext_id == order.yextId).first()
-        if existing_store:
-            raise HTTPException(status_code=400, detail="Listing with yextId already exists.")
 
+def base_local_slug(store: LocalStore):
+    return slugify(f"{store.name} {store.city} {store.zip}")
+
+
+def generate_local_slug(db: Session, store: LocalStore):
+    base_slug = base_local_slug(store)
+
+    # one indexed range scan for the base slug and all of its "-N" variants
+    q = db.query(LocalStore.slug).filter(slug_prefix_filter(base_slug))
+    if store.id is not None:
+        q = q.filter(LocalStore.id != store.id)
+
+    return next_free_slug(base_slug, {slug for slug, in q})
+
+
+def column_values(store: LocalStore, by_column_name=False):
+    return {
+        attr.columns[0].name if by_column_name else attr.key: getattr(store, attr.key)
+        for attr in inspect(LocalStore).column_attrs if attr.key != "id"
+    }
+
+
+def commit_store(db: Session, store: LocalStore, regenerate_slug=True):
+    values = column_values(store)
+
+    for attempt in range(SLUG_ATTEMPTS):
+        if regenerate_slug or not store.slug:
+            store.slug = generate_local_slug(db, store)
+
+        db.add(store)
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # most likely a concurrent order took the same slug, allocate again
+            db.rollback()
+            if attempt == SLUG_ATTEMPTS - 1:
+                raise
+
+            store.fill(**{key: value for key, value in values.items() if key != "slug"})
+            regenerate_slug = True
+
+
+# inserted=True skips the response cache purge: a store page only gets cached once it answers
+# 200, so a new store has nothing to purge, and a batch would scan the cache once per listing
+def store_changed(store: LocalStore, previous_slug: str = None, inserted: bool = False):
+    if not inserted:
+        paths = []
+        for slug in {store.slug, previous_slug} - {None}:
+            paths += [f"/stores/local/{slug}", f"/discounts/{slug}"]
+
+        response_cache.purge(*paths)
+
+    if geo_index.ready:
+        geo_index.update_store(store)
+
+    if search_index.ready:
+        search_index.update_store(store)
+
+
+def build_local_store(order: yext.YextListingCreate) -> LocalStore:
     yext_data = yext.YextData(
         images=order.images,
         categories=order.categories,
@@ -72,8 +158,7 @@ def yext_listing_order(order: yext.YextListingCreate, db: Session = Depends(get_
         phones=order.phones
     )
 
-    # Create a new store listing
-    store = LocalStore(
+    return LocalStore(
         name=order.name,
         description=order.description,
         phone=yext_data.main_phone,
@@ -95,12 +180,10 @@ def yext_listing_order(order: yext.YextListingCreate, db: Session = Depends(get_
         date_updated=datetime.now(),
         date_deleted=None,
         hours_text=order.hoursText.display if order.hoursText else None,
-        slug=generate_local_slug(db, store)
     )
 
-    db.add(store)
-    db.commit()
 
+def listing_created(store: LocalStore):
     return {
         "status": "LIVE",
         "id": store.id,  # This is the store ID (8coupons ID)
@@ -108,9 +191,130 @@ def yext_listing_order(order: yext.YextListingCreate, db: Session = Depends(get_
     }
 
 
+@app.post("/powerlistings/order")
+def yext_listing_order(order: yext.YextListingCreate, db: Session = Depends(get_db)):
+
+    # Check if the store already exists by yextId
+    if order.yextId:
+        if db.query(exists().where(LocalStore.yext_id == order.yextId)).scalar():
+            raise HTTPException(status_code=400, detail=DUPLICATE_YEXT_ID)
+
+    # Create a new store listing
+    store = build_local_store(order)
+
+    commit_store(db, store)
+    store_changed(store, inserted=True)
+
+    return listing_created(store)
+
+
+def parse_listings(body: bytes, content_type: str):
+    if "ndjson" in content_type:
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        for line in lines:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise models.ValidationError("listings", "invalid JSON")
+
+    if not isinstance(items, list):
+        raise models.ValidationError("listings", "expected an array of listings")
+
+    return items
+
+
+def insert_listings(db: Session, stores: dict, results: list):
+    base_slugs = {index: base_local_slug(store) for index, store in stores.items()}
+    q = db.query(LocalStore.slug).filter(or_(*[slug_prefix_filter(base) for base in set(base_slugs.values())]))
+    taken = {slug for slug, in q}
+
+    for index, store in stores.items():
+        store.slug = next_free_slug(base_slugs[index], taken)
+        taken.add(store.slug)
+
+    rows = [column_values(store, by_column_name=True) for store in stores.values()]
+
+    try:
+        db.execute(LocalStore.__table__.insert(), rows)
+        db.commit()
+    except IntegrityError:
+        # a concurrent writer took one of the slugs, fall back to one commit per listing
+        db.rollback()
+        for index, store in stores.items():
+            try:
+                commit_store(db, store)
+            except IntegrityError as e:
+                db.rollback()
+                results[index] = {"error": {"message": str(e.orig)}}
+                continue
+            results[index] = listing_created(store)
+            store_changed(store, inserted=True)
+        return
+
+    slugs = [store.slug for store in stores.values()]
+    ids = dict(db.query(LocalStore.slug, LocalStore.id).filter(LocalStore.slug.in_(slugs)))
+    for index, store in stores.items():
+        store.id = ids.get(store.slug)
+        results[index] = listing_created(store)
+        store_changed(store, inserted=True)
+
+
+def ingest_listings(db: Session, items: list):
+    results = [None] * len(items)
+    orders = {}
+    for index, item in enumerate(items):
+        if item is None:
+            results[index] = rejected([{"msg": "invalid JSON", "loc": ()}])
+            continue
+        try:
+            orders[index] = yext.YextListingCreate.parse_obj(item)
+        except pydantic.ValidationError as e:
+            results[index] = rejected(e.errors(), loc_offset=0)
+
+    indexes = list(orders)
+    seen = set()
+    for start in range(0, len(indexes), BATCH_CHUNK_SIZE):
+        chunk = indexes[start:start + BATCH_CHUNK_SIZE]
+        yext_ids = {orders[index].yextId for index in chunk}
+        existing = {str(yext_id) for yext_id, in db.query(LocalStore.yext_id).filter(LocalStore.yext_id.in_(yext_ids))}
+
+        stores = {}
+        for index in chunk:
+            order = orders[index]
+            if order.yextId in existing or order.yextId in seen:
+                results[index] = {"error": {"message": DUPLICATE_YEXT_ID}}
+                continue
+            seen.add(order.yextId)
+
+            try:
+                stores[index] = build_local_store(order)
+            except models.ValidationError as e:
+                results[index] = rejected(e.errors())
+
+        if stores:
+            insert_listings(db, stores, results)
+
+    return results
+
+
+@app.post("/powerlistings/order/batch")
+async def yext_listing_order_batch(request: Request, db: Session = Depends(get_db)):
+    items = parse_listings(await request.body(), request.headers.get("content-type", ""))
+    return await run_in_threadpool(ingest_listings, db, items)
+
+
 @app.put("/powerlistings/{listing_id}")
 def yext_listing_order(listing_id: int, data: yext.YextListingUpdate, db: Session = Depends(get_db)):
-    store = db.query(LocalStore).filter(LocalStore.id == listing_id).one()
+    store = db.query(LocalStore).filter(LocalStore.id == listing_id).options(*LocalStore.full_options()).one()
+    previous_slug = store.slug
+    previous_slug_source = slug_source(store)
 
     yext_data = store.yext or yext.YextData()
 
@@ -151,10 +355,8 @@ def yext_listing_order(listing_id: int, data: yext.YextListingUpdate, db: Sessio
     if data.hoursText:
         store.hours_text = data.hoursText.display
 
-    store.slug = generate_local_slug(db, store)
-
-    db.add(store)
-    db.commit()
+    commit_store(db, store, regenerate_slug=slug_source(store) != previous_slug_source)
+    store_changed(store, previous_slug)
 
     return {
         "status": "LIVE",
@@ -169,6 +371,7 @@ def delete_listing(listing_id: int, db: Session = Depends(get_db)):
     store.date_deleted = datetime.now()
     store.yext_canceled = True
     db.commit()
+    store_changed(store)
 
     return {
         "ok": True
@@ -182,6 +385,7 @@ def suppress_listing(payload: yext.YextListingSuppress, db: Session = Depends(ge
     store.yext_suppressed = payload.suppress
     store.canonical_id = payload.canonicalListingId if payload.suppress else None
     db.commit()
+    store_changed(store)
 
     return {
         "ok": True
@@ -211,32 +415,242 @@ def get_store_details(store: models.LocalStore):
 
 
 @app.get("/details")
-def details_listing(storeID: str, db: Session = Depends(get_db)):
-    store = models.LocalStore.get_by(db, id=storeID, include_deleted=True)
-    return get_store_details(store)
+async def details_listing(storeID: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(LocalStore).filter_by(id=storeID).options(*LocalStore.summary_options()))
+    return get_store_details(result.scalar_one())
+
+
+async def load_store_details(db: AsyncSession, store_ids):
+    store_ids = list(dict.fromkeys(store_ids))
+    if len(store_ids) > DETAILS_MAX_IDS:
+        raise models.ValidationError("storeIDs", f"at most {DETAILS_MAX_IDS} store IDs per request")
+
+    stores = {}
+    for start in range(0, len(store_ids), DETAILS_CHUNK_SIZE):
+        result = await db.execute(select(LocalStore)
+                                  .where(LocalStore.id.in_(store_ids[start:start + DETAILS_CHUNK_SIZE]))
+                                  .options(*LocalStore.summary_options()))
+        stores.update((store.id, store) for store in result.scalars())
+
+    return [
+        get_store_details(stores[store_id]) if store_id in stores
+        else {"id": store_id, "error": {"message": "Not found"}}
+        for store_id in store_ids
+    ]
+
+
+@app.get("/details/batch")
+async def details_listing_batch(storeIDs: str, db: AsyncSession = Depends(get_async_db)):
+    try:
+        store_ids = [int(store_id) for store_id in storeIDs.split(",") if store_id.strip()]
+    except ValueError:
+        raise models.ValidationError("storeIDs", "storeIDs must be a comma separated list of integers")
+
+    return await load_store_details(db, store_ids)
+
+
+@app.post("/details/batch")
+async def details_listing_batch_post(payload: yext.YextDetailsRequest, db: AsyncSession = Depends(get_async_db)):
+    return await load_store_details(db, payload.storeIDs)
+
+
+def export_lines(updated_since: Optional[datetime], status: Optional[str], country: Optional[str],
+                 include_deleted: bool):
+    filters = []
+    if updated_since:
+        filters.append(LocalStore.date_updated >= updated_since)
+    if status:
+        filters.append(LocalStore.status_filter(status))
+    if country:
+        filters.append(LocalStore.country == country)
+    if not include_deleted:
+        filters.append(LocalStore.date_deleted.is_(None))
+
+    q = (select(LocalStore)
+         .where(*filters)
+         .options(*LocalStore.summary_options())
+         .order_by(LocalStore.id)
+         .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    # the request's session is gone once streaming starts, so the export holds its own
+    db = SessionLocal()
+    try:
+        lines = []
+        for store in db.execute(q).scalars():
+            lines.append(json.dumps(jsonable_encoder(get_store_details(store))) + "\n")
+            if len(lines) == EXPORT_BATCH_SIZE:
+                yield "".join(lines).encode()
+                lines = []
+        if lines:
+            yield "".join(lines).encode()
+    finally:
+        db.close()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# a reconciliation export: suppressed and canceled listings carry date_deleted, so they are
+# included unless include_deleted=false
+@app.get("/export")
+def export_listings(updated_since: datetime = None, status: str = None, country: str = None,
+                    include_deleted: bool = True, format: str = "ndjson"):
+    if format not in ("ndjson", "gzip"):
+        raise models.ValidationError("format", "format must be ndjson or gzip")
+    if status:
+        # raises on an unknown status before the response starts streaming
+        LocalStore.status_filter(status)
+
+    body = export_lines(updated_since, status, country, include_deleted)
+    if format == "gzip":
+        return StreamingResponse(gzipped(body), media_type="application/gzip",
+                                 headers={"Content-Disposition": 'attachment; filename="listings.ndjson.gz"'})
+
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(",".join(repr(value) for value in values).encode()).decode()
+
+
+def decode_cursor(cursor: str, *types):
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split(",")
+        return [type_(value) for type_, value in zip(types, values, strict=True)]
+    except ValueError:
+        raise models.ValidationError("cursor", "invalid cursor")
+
+
+def parse_latlng(latlng: str):
+    try:
+        lat, lng = (float(value) for value in latlng.split(","))
+    except ValueError:
+        raise models.ValidationError("latlng", "latlng must be two comma separated numbers")
+    return lat, lng
+
+
+async def search_geo_index(response: Response, db: AsyncSession, lat, lng, radius, cursor, limit):
+    hits = geo_index.within(lat, lng, radius)
+    if cursor:
+        last = tuple(decode_cursor(cursor, float, int))
+        hits = [hit for hit in hits if hit > last]
+
+    if len(hits) > limit:
+        hits = hits[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(*hits[-1])
+
+    result = await db.execute(select(LocalStore)
+                              .where(LocalStore.id.in_([store_id for _, store_id in hits]))
+                              .options(*LocalStore.summary_options()))
+    stores = {store.id: store for store in result.scalars()}
+
+    details = []
+    for distance, store_id in hits:
+        if store_id in stores:
+            details.append({**get_store_details(stores[store_id]), "distance_miles": round(distance, 3)})
+
+    return details
 
 
 @app.get("/search")
-def details_listing(phone=None, country_code=None, name=None, latlng: str = None, db: Session = Depends(get_db)):
-    stores = []
+async def details_listing(response: Response, phone=None, country_code=None, name=None, latlng: str = None,
+                          radius: float = SEARCH_RADIUS_MILES, cursor: str = None, limit: int = SEARCH_LIMIT,
+                          db: AsyncSession = Depends(get_async_db)):
     filters = []
     if phone:
-        filters.append(LocalStore.phone == phone)
+        filters.append(LocalStore.phone_normalized == (util.normalize_phone(phone) or ""))
 
     if country_code:
         filters.append(LocalStore.country == country_code)
 
     if name:
-        filters.append(LocalStore.name.startswith(name))
+        filters.append(LocalStore.name_normalized.startswith(util.normalize_name(name) or "", autoescape=True))
+
+    if not filters and not latlng:
+        return []
+
+    if radius <= 0:
+        raise models.ValidationError("radius", "radius must be greater than 0")
+
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    radius = min(radius, SEARCH_MAX_RADIUS_MILES)
+    q = select(LocalStore)
 
     if latlng:
-        lat, lng = latlng.split(",")
-        filters.append(LocalStore.within_radius(float(lat), float(lng), 10))
+        lat, lng = parse_latlng(latlng)
+
+        # pure geo lookups are answered by the in-memory index when it is loaded
+        if not filters and geo_index.ready:
+            return await search_geo_index(response, db, lat, lng, radius, cursor, limit)
+
+        distance = LocalStore.distance_miles(lat, lng)
+        # same stores as the geo index holds
+        filters.append(LocalStore.listed_filter())
+        filters.append(LocalStore.within_radius(lat, lng, radius))
+        q = select(LocalStore, distance.label("distance_miles")).order_by(distance, LocalStore.id)
 
-    if filters:
-        stores = db.query(LocalStore).filter(*filters).limit(30).all()
+        if cursor:
+            last_distance, last_id = decode_cursor(cursor, float, int)
+            filters.append(or_(distance > last_distance, and_(distance == last_distance, LocalStore.id > last_id)))
+    else:
+        q = q.order_by(LocalStore.id)
 
-    return [get_store_details(store) for store in stores]
+        if cursor:
+            last_id, = decode_cursor(cursor, int)
+            filters.append(LocalStore.id > last_id)
+
+    result = await db.execute(q.where(*filters).options(*LocalStore.summary_options()).limit(limit + 1))
+    rows = result.all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(*last[1:], last[0].id) if latlng else encode_cursor(last[0].id)
+
+    stores = []
+    for row in rows:
+        details = get_store_details(row[0])
+        if latlng:
+            details["distance_miles"] = round(row[1], 3)
+        stores.append(details)
+
+    return stores
+
+
+# the `limit` listed stores closest to latlng, at most `radius` miles away
+@app.get("/nearest")
+async def nearest_listings(latlng: str, limit: int = SEARCH_LIMIT, radius: float = SEARCH_MAX_RADIUS_MILES,
+                           db: AsyncSession = Depends(get_async_db)):
+    if radius <= 0:
+        raise models.ValidationError("radius", "radius must be greater than 0")
+
+    lat, lng = parse_latlng(latlng)
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    radius = min(radius, SEARCH_MAX_RADIUS_MILES)
+
+    if geo_index.ready:
+        hits = geo_index.nearest(lat, lng, limit, max_radius_miles=radius)
+    else:
+        distance = LocalStore.distance_miles(lat, lng)
+        result = await db.execute(select(LocalStore.id, distance)
+                                  .where(LocalStore.listed_filter(), LocalStore.within_radius(lat, lng, radius))
+                                  .order_by(distance, LocalStore.id)
+                                  .limit(limit))
+        hits = [(distance, store_id) for store_id, distance in result.all()]
+
+    result = await db.execute(select(LocalStore)
+                              .where(LocalStore.id.in_([store_id for _, store_id in hits]))
+                              .options(*LocalStore.summary_options()))
+    stores = {store.id: store for store in result.scalars()}
+
+    return [{**get_store_details(stores[store_id]), "distance_miles": round(distance, 3)}
+            for distance, store_id in hits if store_id in stores]
 
 
 @app.get("/health_check")
@@ -1,41 +1,80 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, APIRouter
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import NoResultFound
-from app.db import SessionLocal, get_db
+from app.db import get_async_db
 from app import models
-from fastapi.templating import Jinja2Templates
+from app.cache import LRUCache
+from app.pages import PageSnapshot, find_page_async, get_page_async
+from app.public_files import public_files
+from app import pages
+from app.cities import CityRecord, city_directory
+from app.search import search_index
+from app.response_cache import ResponseCacheMiddleware, cache_response
 from app.settings import settings
-from urllib.parse import unquote, urlparse
+from app.templating import create_templates, css_hash, stream_template
+from urllib.parse import urlparse
 from datetime import datetime
-from app.geo import GeoLocation, get_geo
+from dataclasses import replace
+from app.geo import get_geo
 import hashlib
+import math
 from fastapi.responses import RedirectResponse
 
 
-CSS_HASH = hashlib.md5(open('static/main.css', 'rb').read()).hexdigest()
+app = FastAPI(docs_url=None, redoc_url=None)
+if settings.response_cache_enabled:
+    app.add_middleware(ResponseCacheMiddleware)
 
+templates = create_templates()
 
-app = FastAPI(docs_url=None, redoc_url=None)
-templates = Jinja2Templates(directory=settings.template_dir)
+# compiled Page.title/Page.content templates, keyed by (page id, source hash)
+compiled_templates = LRUCache(maxsize=settings.template_cache_size)
 
 
-def get_page(db: Session, path: str):
-    return db.query(models.Page).filter(models.Page.path == path).one()
+# catch-all paths that matched no city, page or public file, kept apart from the page cache
+# so bot probes cannot evict real pages
+unknown_paths = LRUCache(maxsize=settings.unknown_path_cache_size, ttl=settings.page_cache_ttl)
 
 
-def query_city(db: Session, city_slug: str = None):
-    q = db.query(models.City)
-    if city_slug:
-        q = q.filter(models.City.slug == city_slug)
+@event.listens_for(models.Page, "after_update")
+@event.listens_for(models.Page, "after_delete")
+def invalidate_compiled_templates(mapper, connection, page: models.Page):
+    compiled_templates.pop_where(lambda key: key[0] == page.id)
 
-    return q
 
+@event.listens_for(models.Page, "after_insert")
+@event.listens_for(models.Page, "after_update")
+def forget_unknown_path(mapper, connection, page: models.Page):
+    unknown_paths.pop(page.path)
 
-def render_string(template_string, context: dict, throw_errors=False):
-    try:
+
+def query_city(city_slug: str) -> CityRecord:
+    city = city_directory.get(city_slug)
+    if city is None:
+        raise NoResultFound(f"No city found for slug '{city_slug}'")
+
+    return city
+
+
+def compile_string(template_string, cache_key=None):
+    if cache_key is None:
+        return templates.env.from_string(template_string)
+
+    key = (cache_key, hashlib.md5(template_string.encode()).hexdigest())
+    template = compiled_templates.get(key)
+    if template is None:
         template = templates.env.from_string(template_string)
+        compiled_templates.set(key, template)
+
+    return template
+
+
+def render_string(template_string, context: dict, throw_errors=False, cache_key=None):
+    try:
+        template = compile_string(template_string, cache_key)
         return template.render(context)
     except Exception as e:
         if throw_errors:
@@ -43,26 +82,30 @@ def render_string(template_string, context: dict, throw_errors=False):
         return template_string
 
 
-def render_page(page: models.Page, context: dict, status_code=200, template_name="page.html"):
+def render_page(page: PageSnapshot, context: dict, status_code=200, template_name="page.html", stream=False):
     if page.title:
-        page.title = render_string(page.title, context)
+        page = replace(page, title=render_string(page.title, context, cache_key=page.id))
 
     if page.content:
-        page.content = render_string(page.content, context)
+        page = replace(page, content=render_string(page.content, context, cache_key=page.id))
 
     context['page'] = page
 
+    if stream:
+        template = templates.get_template(template_name)
+        return StreamingResponse(stream_template(template, context), status_code=status_code, media_type="text/html")
+
     return templates.TemplateResponse(template_name, context, status_code=status_code)
 
 
-def get_context(request: Request, db: Session = None, city: models.City = None):
+def get_context(request: Request, city: CityRecord = None):
     return {
         "now": datetime.now(),
         "request": request,
         "request_url": urlparse(str(request.url)),
-        "cities": db.query(models.City) if db else None,
+        "cities": city_directory,
         "geo": get_geo(request, city=city),
-        "css_hash": CSS_HASH if not settings.debug else str(datetime.now())
+        "css_hash": css_hash() if not settings.debug else str(datetime.now())
     }
 
 
@@ -78,33 +121,64 @@ def http_exception_handler(request, exc: Exception):
     return templates.TemplateResponse("500.html", get_context(request), status_code=500)
 
 
+# admin endpoints answer 404 unless admin_token is set and sent as X-Admin-Token
+def require_admin_token(request: Request):
+    if not settings.admin_token or request.headers.get("x-admin-token") != settings.admin_token:
+        raise HTTPException(status_code=404)
+
+
+@app.post("/_cache/pages/invalidate", dependencies=[Depends(require_admin_token)])
+def invalidate_pages(path: str = None):
+    pages.invalidate(path)
+    if path is None:
+        unknown_paths.clear()
+    else:
+        unknown_paths.pop(path)
+
+    return JSONResponse({"ok": True})
+
+
+@app.post("/_cache/public/reload", dependencies=[Depends(require_admin_token)])
+def reload_public_files():
+    public_files.load()
+
+    return JSONResponse({"ok": True, "files": len(public_files)})
+
+
 @app.get("/stores/local/{slug}")
-def get_local_store(request: Request, slug: str, db: Session = Depends(get_db)):
-    store = db.query(models.LocalStore).filter(models.LocalStore.slug == slug).first()
+@cache_response()
+async def get_local_store(request: Request, slug: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.LocalStore)
+                              .where(models.LocalStore.slug == slug)
+                              .options(*models.LocalStore.full_options()))
+    store = result.scalars().first()
 
     if not store:
         return RedirectResponse(url="/", status_code=302)
 
-    page = get_page(db, "/stores/local/{slug}")
+    page = await get_page_async(db, "/stores/local/{slug}")
     context = get_context(request)
     context['store'] = store
 
-    return render_page(page, context, template_name="pages/store_listing.html")
+    return render_page(page, context, template_name="pages/store_listing.html", stream=True)
 
 
 @app.get("/discounts/{slug}")
-def get_discounts(request: Request, slug: str, db: Session = Depends(get_db)):
-    return get_local_store(request, slug, db)
+@cache_response()
+async def get_discounts(request: Request, slug: str, db: AsyncSession = Depends(get_async_db)):
+    return await get_local_store(request, slug, db)
 
 
 @app.get("/stores/online/{slug}")
-def get_online_store(request: Request, slug: str, db: Session = Depends(get_db)):
-    store = db.query(models.OnlineStore).filter(models.OnlineStore.slug == slug).first()
+@cache_response()
+async def get_online_store(request: Request, slug: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.OnlineStore).where(models.OnlineStore.slug == slug))
+    store = result.scalars().first()
 
     if not store:
         return RedirectResponse(url="/", status_code=302)
 
-    page = get_page(db, "/stores/online/{slug}")
+    page = await get_page_async(db, "/stores/online/{slug}")
     context = get_context(request)
     context['store'] = store
 
@@ -112,13 +186,15 @@ def get_online_store(request: Request, slug: str, db: Session = Depends(get_db))
 
 
 @app.get("/stores/chain/{slug}")
-def get_chain_store(request: Request, slug: str, db: Session = Depends(get_db)):
-    store = db.query(models.Chain).filter(models.Chain.slug == slug).first()
+@cache_response()
+async def get_chain_store(request: Request, slug: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.Chain).where(models.Chain.slug == slug))
+    store = result.scalars().first()
 
     if not store:
         return RedirectResponse(url="/", status_code=302)
 
-    page = get_page(db, "/stores/chain/{slug}")
+    page = await get_page_async(db, "/stores/chain/{slug}")
     context = get_context(request)
     context['store'] = store
 
@@ -126,19 +202,22 @@ def get_chain_store(request: Request, slug: str, db: Session = Depends(get_db)):
 
 
 @app.get("/coupons/{chain_name}")
-def get_online_store(request: Request, chain_name: str, db: Session = Depends(get_db)):
-    page = get_page(db, "/stores/chain/{slug}")
+@cache_response()
+async def get_online_store(request: Request, chain_name: str, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, "/stores/chain/{slug}")
     context = get_context(request)
-    context['store'] = db.query(models.Chain).filter(models.Chain.name == chain_name.replace("_", " ")).one()
+    result = await db.execute(select(models.Chain).where(models.Chain.name == chain_name.replace("_", " ")))
+    context['store'] = result.scalar_one()
 
     return render_page(page, context, template_name="pages/store_listing.html")
 
 
 @app.get("/city/{city_slug}")
-def get_city(request: Request, city_slug: str, db: Session = Depends(get_db)):
+@cache_response()
+async def get_city(request: Request, city_slug: str, db: AsyncSession = Depends(get_async_db)):
     city_slug = city_slug.replace("_", "-")
-    city = db.query(models.City).filter(models.City.slug == city_slug).one()
-    page = get_page(db, "/city/{slug}")
+    city = query_city(city_slug)
+    page = await get_page_async(db, "/city/{slug}")
     context = get_context(request, city=city)
     context["city"] = city
 
@@ -146,13 +225,14 @@ def get_city(request: Request, city_slug: str, db: Session = Depends(get_db)):
 
 
 @app.get("/cities/{state_code}")
-def get_city(request: Request, state_code: str, db: Session = Depends(get_db)):
-    cities = db.query(models.City).filter(models.City.state_code == state_code).all()
+@cache_response()
+async def get_city(request: Request, state_code: str, db: AsyncSession = Depends(get_async_db)):
+    cities = city_directory.by_state(state_code)
 
     if len(cities) == 0:
         raise HTTPException(status_code=404)
 
-    page = get_page(db, "/cities/{state_code}")
+    page = await get_page_async(db, "/cities/{state_code}")
     context = get_context(request)
     context["state_cities"] = cities
     context["state"] = cities[0].state
@@ -161,77 +241,102 @@ def get_city(request: Request, state_code: str, db: Session = Depends(get_db)):
 
 
 @app.get("/deals/{category_slug}")
-def get_deals(request: Request, category_slug: str, db: Session = Depends(get_db), city=None):
-    page = get_page(db, f"/deals/{category_slug}")
+@cache_response()
+async def get_deals(request: Request, category_slug: str, db: AsyncSession = Depends(get_async_db), city=None):
+    page = await get_page_async(db, f"/deals/{category_slug}", cache_missing=False)
     context = get_context(request, city=city)
 
     return render_page(page, context, template_name="pages/deals.html")
 
 
 @app.get("/deals/{category_slug}/{city_slug}")
-def get_deals_city(request: Request, category_slug: str, city_slug: str, db: Session = Depends(get_db)):
-    city = query_city(db, city_slug).one()
-    return get_deals(request, category_slug, db, city=city)
+@cache_response()
+async def get_deals_city(request: Request, category_slug: str, city_slug: str, db: AsyncSession = Depends(get_async_db)):
+    city = query_city(city_slug)
+    return await get_deals(request, category_slug, db, city=city)
 
 
 @app.get("/coupons")
-def get_coupons(request: Request, db: Session = Depends(get_db)):
-    page = get_page(db, f"/coupons")
+async def get_coupons(request: Request, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, f"/coupons")
     context = get_context(request)
 
     return render_page(page, context, template_name="pages/deals.html")
 
 
 @app.get("/events")
-def get_events(request: Request, db: Session = Depends(get_db), city=None):
-    page = get_page(db, f"/events")
+async def get_events(request: Request, db: AsyncSession = Depends(get_async_db), city=None):
+    page = await get_page_async(db, f"/events")
     context = get_context(request, city=city)
 
     return render_page(page, context, template_name="pages/deals.html")
 
 
 @app.get("/events/{city_slug}")
-def get_events_city(request: Request, city_slug: str, db: Session = Depends(get_db)):
-    city = query_city(db, city_slug).one()
-    return get_events(request, db, city=city)
+async def get_events_city(request: Request, city_slug: str, db: AsyncSession = Depends(get_async_db)):
+    city = query_city(city_slug)
+    return await get_events(request, db, city=city)
 
 
 @app.get("/holidays/{slug}")
-def get_holidays(request: Request, slug: str, db: Session = Depends(get_db)):
-    page = get_page(db, f"/holidays/{slug}")
+async def get_holidays(request: Request, slug: str, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, f"/holidays/{slug}", cache_missing=False)
     context = get_context(request)
 
     return render_page(page, context, template_name="pages/deals.html")
 
 
 @app.get("/search")
-def get_index(request: Request, db: Session = Depends(get_db)):
-    page = get_page(db, "/")
+async def get_index(request: Request, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, "/")
     context = get_context(request)
     context['keywords'] = request.query_params.get("keywords", "")
 
+    if search_index.ready:
+        try:
+            page_number = max(1, int(request.query_params.get("page", 1)))
+        except ValueError:
+            page_number = 1
+
+        # results are limited to the visitor's state when we know it, unless they ask for scope=all
+        geo = context["geo"]
+        state_code = geo.state_code if geo.known and request.query_params.get("scope") != "all" else None
+        total, store_ids = search_index.search(
+            context['keywords'], state_code=state_code,
+            offset=(page_number - 1) * settings.search_page_size, limit=settings.search_page_size)
+
+        result = await db.execute(select(models.LocalStore)
+                                  .where(models.LocalStore.id.in_(store_ids))
+                                  .options(*models.LocalStore.listing_options()))
+        stores = {store.id: store for store in result.scalars()}
+
+        context['results'] = [stores[store_id] for store_id in store_ids if store_id in stores]
+        context['total'] = total
+        context['page_number'] = page_number
+        context['pages'] = math.ceil(total / settings.search_page_size)
+
     return render_page(page, context, template_name="pages/search.html")
 
 
 @app.get("/api/terms")
-def get_index(request: Request, db: Session = Depends(get_db)):
-    page = get_page(db, "/terms-and-conditions")
+async def get_index(request: Request, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, "/terms-and-conditions")
     context = get_context(request)
 
     return render_page(page, context)
 
 
 @app.get("/")
-def get_index(request: Request, db: Session = Depends(get_db)):
-    page = get_page(db, "/")
+async def get_index(request: Request, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, "/")
     context = get_context(request)
 
     return render_page(page, context, template_name="pages/home.html")
 
 
 @app.get("/partner/{partner}")
-def get_partner(request: Request, partner: str, db: Session = Depends(get_db)):
-    page = get_page(db, "/update-business-listing")
+async def get_partner(request: Request, partner: str, db: AsyncSession = Depends(get_async_db)):
+    page = await get_page_async(db, "/update-business-listing")
     context = get_context(request)
     if partner == "localsaver":
         context['redirect_url'] = "http://ls.localsaver.com/8coupons/"
@@ -244,19 +349,29 @@ def get_partner(request: Request, partner: str, db: Session = Depends(get_db)):
 
 
 @app.get("/{full_path:path}")
-def catch_all_pages(full_path: str, request: Request, db: Session = Depends(get_db)):
-    city = db.query(models.City).filter(models.City.slug == full_path).first()
+async def catch_all_pages(full_path: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # public files and paths already known to 404 are answered before any database work
+    public_file = public_files.get(full_path)
+    if public_file:
+        return public_files.response(public_file, request)
+
+    if unknown_paths.get("/" + full_path):
+        raise HTTPException(404)
+
+    city = city_directory.get(full_path)
     template_name = "page.html"
-    context = get_context(request, db, city=city)
+    context = get_context(request, city=city)
     context["city"] = city
 
     if city:
         template_name = "pages/home.html"
         full_path = ""
 
-    page = db.query(models.Page).filter(models.Page.path == "/" + full_path).first()
+    # misses are remembered in unknown_paths only, bot probes must not push pages out of page_cache
+    page = await find_page_async(db, "/" + full_path, cache_missing=False)
 
     if not page:
-        return FileResponse(f"resources/public/{full_path}")
+        unknown_paths.set("/" + full_path, True)
+        raise HTTPException(404)
 
     return render_page(page, context, template_name=template_name)
@@ -91,6 +91,29 @@ class YextData(pydantic.BaseModel):
     class Config:
         allow_mutation = False
 
+    # builds the model from yext_data already validated on write, skipping validation
+    @classmethod
+    def from_db(cls, data: dict) -> "YextData":
+        phones = []
+        for phone in data.get("phones") or []:
+            number = phone.get("number")
+            if isinstance(number, str):
+                number = {"number": number, "countryCode": phone.get("countryCode")}
+            phones.append(YextPhone.construct(
+                number=YextPhoneNumber.construct(**number), type=phone.get("type"), description=phone.get("description")))
+
+        special_offer = data.get("special_offer")
+        return cls.construct(
+            images=[YextImage.construct(**image) for image in data.get("images") or []],
+            categories=[YextCategory.construct(**category) for category in data.get("categories") or []],
+            payment_options=data.get("payment_options"),
+            emails=[YextEmail.construct(**email) for email in data.get("emails") or []],
+            videos=[YextVideo.construct(**video) for video in data.get("videos") or []],
+            urls=[YextUrl.construct(**url) for url in data.get("urls") or []],
+            phones=phones,
+            special_offer=YextSpecialOffer.construct(**special_offer) if special_offer else None,
+        )
+
     @property
     def logo_url(self):
         for img in self.images:
@@ -166,3 +189,7 @@ class YextListingSuppress(pydantic.BaseModel):
     listingId: str
     suppress: bool
     canonicalListingId: Optional[str]
+
+
+class YextDetailsRequest(pydantic.BaseModel):
+    storeIDs: List[int]
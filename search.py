@@ -0,0 +1,151 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.db import SessionLocal
+from app.models import LocalStore
+import heapq
+import math
+import re
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+FIELD_WEIGHTS = {"name": 3.0, "categories": 2.0, "city": 2.0, "description": 1.0}
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def tokenize(text: Optional[str]):
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+# In-process inverted index over LocalStore name, categories, city and description.
+# Every query term must match; the last one also matches as a prefix so partial words work.
+class StoreSearchIndex:
+    def __init__(self):
+        self.ready = False
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._terms = None
+        self._lock = Lock()
+
+    def load(self, db: Session):
+        q = (db.query(LocalStore)
+             .filter(LocalStore.date_deleted.is_(None))
+             .options(*LocalStore.summary_options())
+             .yield_per(2000))
+
+        index = StoreSearchIndex()
+        for store in q:
+            index._add(store.id, store_fields(store), store.state)
+
+        with self._lock:
+            self._postings, self._documents, self._terms = index._postings, index._documents, None
+            self.ready = True
+
+    def refresh(self):
+        db = SessionLocal()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def _add(self, store_id: int, fields: dict, state: Optional[str]):
+        weights = Counter()
+        for field, text in fields.items():
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._terms = None
+            self._postings[token][store_id] = weight
+
+        self._documents[store_id] = (tuple(weights), (state or "").upper())
+
+    def _remove(self, store_id: int):
+        tokens, _ = self._documents.pop(store_id, ((), None))
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(store_id, None)
+            if not postings:
+                del self._postings[token]
+                self._terms = None
+
+    def update_store(self, store: LocalStore):
+        if store.id is None:
+            return
+
+        with self._lock:
+            self._remove(store.id)
+            if not store.date_deleted:
+                self._add(store.id, store_fields(store), store.state)
+
+    def _expand(self, prefix: str):
+        if self._terms is None:
+            self._terms = sorted(self._postings)
+
+        start = bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query: str, state_code: str = None, offset=0, limit=20) -> Tuple[int, List[int]]:
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        state_code = state_code.upper() if state_code else None
+
+        with self._lock:
+            total_documents = len(self._documents) or 1
+
+            # one group of (postings, idf) per query token, the last token expanded as a prefix
+            groups = []
+            for i, token in enumerate(tokens):
+                terms = self._expand(token) if i == len(tokens) - 1 else [token]
+                group = [(self._postings[term], math.log(1 + total_documents / len(self._postings[term])))
+                         for term in terms if term in self._postings]
+                if not group:
+                    return 0, []
+                groups.append(group)
+
+            # start from the rarest token so the candidate set stays small
+            groups.sort(key=lambda group: sum(len(postings) for postings, _ in group))
+
+            scores = {}
+            for postings, idf in groups[0]:
+                for store_id, weight in postings.items():
+                    if state_code and self._documents[store_id][1] != state_code:
+                        continue
+                    scores[store_id] = max(scores.get(store_id, 0), weight * idf)
+
+            for group in groups[1:]:
+                matched = {}
+                for store_id, score in scores.items():
+                    best = max((postings[store_id] * idf for postings, idf in group if store_id in postings), default=None)
+                    if best is not None:
+                        matched[store_id] = score + best
+                scores = matched
+
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return len(scores), [store_id for store_id, _ in ranked[offset:]]
+
+    def __len__(self):
+        return len(self._documents)
+
+
+def store_fields(store: LocalStore):
+    return {
+        "name": store.name,
+        "categories": " ".join(category.name for category in store.categories),
+        "city": store.city,
+        "description": store.description,
+    }
+
+
+search_index = StoreSearchIndex()
@@ -1,12 +1,55 @@
 from pydantic import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
     debug = False
     template_loader = "local"
     template_dir = "resources/templates"
+    template_compiled_dir = "build/templates"
+    template_bytecode_cache = True
+    template_bytecode_cache_dir: Optional[str] = None
+    template_cache_size = 512
+    page_cache_size = 256
+    page_cache_ttl = 60
+    yext_cache_size = 4096
+    unknown_path_cache_size = 4096
+    public_dir = "resources/public"
+    public_file_memory_limit = 64 * 1024
+    public_file_max_age = 3600
+    public_files_refresh_interval = 60
+    admin_token: Optional[str] = None
+    city_refresh_interval = 600
+    geo_index_enabled = False
+    geo_index_cell_degrees = 0.25
+    geo_index_refresh_interval = 300
+    search_index_enabled = False
+    search_index_refresh_interval = 600
+    search_page_size = 20
+    compression_enabled = True
+    compression_min_size = 1024
+    compression_level = 6
+    compression_brotli_quality = 4
+    compression_types: List[str] = [
+        "text/html", "text/css", "text/plain", "text/xml", "text/javascript", "application/javascript",
+        "application/json", "application/x-ndjson", "application/xml", "image/svg+xml",
+    ]
+    response_cache_enabled = False
+    response_cache_max_bytes = 64 * 1024 * 1024
+    response_cache_ttl = 60
+    response_cache_stale_ttl = 300
     database_url: str
+    async_database_url: Optional[str] = None
+    database_replica_urls: List[str] = []
+    replica_health_check_interval = 15
+    db_pool_size = 25
+    db_max_overflow = 5
+    db_pool_timeout = 30
+    db_pool_recycle = -1
+    db_pool_pre_ping = False
+    threads_limit = 40
+    server_timing_enabled = True
+    n_plus_one_threshold = 10
     app_url = "http://localhost:8000"
 
     class Config:
@@ -0,0 +1,85 @@
+from functools import lru_cache
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, ModuleLoader
+from app.assets import STATIC_DIR, asset_url
+from app.settings import settings
+import argparse
+import hashlib
+import os
+
+# must match between precompiling and rendering, autoescape is baked into compiled templates
+ENV_OPTIONS = {"autoescape": True}
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+def get_loader():
+    if settings.template_loader == "local":
+        return FileSystemLoader(settings.template_dir)
+
+    if settings.template_loader == "precompiled":
+        return ModuleLoader(settings.template_compiled_dir)
+
+    raise ValueError(f"unknown template_loader {settings.template_loader!r}, expected local or precompiled")
+
+
+def get_bytecode_cache():
+    # precompiled templates are already bytecode
+    if not settings.template_bytecode_cache or settings.template_loader == "precompiled":
+        return None
+
+    if settings.template_bytecode_cache_dir:
+        os.makedirs(settings.template_bytecode_cache_dir, exist_ok=True)
+
+    return FileSystemBytecodeCache(settings.template_bytecode_cache_dir)
+
+
+def create_templates() -> Jinja2Templates:
+    templates = Jinja2Templates(
+        directory=settings.template_dir,
+        loader=get_loader(),
+        bytecode_cache=get_bytecode_cache(),
+        auto_reload=settings.debug,
+        **ENV_OPTIONS,
+    )
+    templates.env.globals["asset_url"] = asset_url
+    return templates
+
+
+# Renders in chunks: the <head> goes out as soon as it is rendered so the browser can start on
+# the stylesheet, the rest is sent in pieces of about STREAM_FLUSH_SIZE characters.
+def stream_template(template, context: dict):
+    buffer = []
+    size = 0
+    head_sent = False
+
+    for chunk in template.generate(context):
+        buffer.append(chunk)
+        size += len(chunk)
+
+        flush_head = not head_sent and "</head>" in chunk
+        if flush_head or size >= STREAM_FLUSH_SIZE:
+            head_sent = head_sent or flush_head
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+@lru_cache(maxsize=None)
+def css_hash():
+    with open(os.path.join(STATIC_DIR, "main.css"), "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def compile_templates(target: str):
+    env = Environment(loader=FileSystemLoader(settings.template_dir), **ENV_OPTIONS)
+    env.compile_templates(target, zip=None, ignore_errors=False)
+
+
+if __name__ == "__main__":
+    # python -m app.templating --target build/templates, then run with TEMPLATE_LOADER=precompiled
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default=settings.template_compiled_dir)
+    compile_templates(parser.parse_args().target)
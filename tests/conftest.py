@@ -0,0 +1,51 @@
+import os
+import pytest
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the project is imported as the `app` package, so run from a scratch directory that has it
+# under that name, with its own SQLite database
+workdir = tempfile.mkdtemp(prefix="y-api-tests-")
+os.symlink(ROOT, os.path.join(workdir, "app"))
+sys.path.insert(0, workdir)
+os.chdir(workdir)
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'test.sqlite')}"
+os.environ["RESPONSE_CACHE_ENABLED"] = "true"
+
+# one bare template stands in for the real ones under resources/templates
+TEMPLATE = ("<html><head><title>{{ page.title if page else '' }}</title></head><body>"
+            "{{ store.name if store else '' }} {{ store.description if store else '' }}{% for result in results or [] %}[{{ result.name }}]{% endfor %}"
+            "</body></html>")
+for name in ["page.html", "404.html", "500.html", "listing/index.html", "pages/deals.html", "pages/home.html",
+             "pages/redirect.html", "pages/search.html", "pages/store_listing.html"]:
+    path = os.path.join(workdir, "resources", "templates", name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(TEMPLATE)
+os.makedirs(os.path.join(workdir, "resources", "public"))
+os.makedirs(os.path.join(workdir, "static"))
+with open(os.path.join(workdir, "static", "main.css"), "w") as f:
+    f.write("body { margin: 0 }\n")
+
+from app.benchmarks.common import use_sqlite_functions  # noqa: E402
+
+use_sqlite_functions()
+
+
+@pytest.fixture
+def db():
+    from app.db import Base, SessionLocal, engine
+
+    from app.response_cache import response_cache
+
+    Base.metadata.create_all(engine)
+    response_cache.clear()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(engine)
@@ -0,0 +1,199 @@
+from fastapi.testclient import TestClient
+from datetime import datetime
+from app import models
+from app.geo_index import StoreGeoIndex
+from app.routes import api_yext
+import json
+import pytest
+
+
+@pytest.fixture
+def client(db):
+    return TestClient(api_yext.app)
+
+
+def add_store(db, slug, latitude, longitude, **columns):
+    columns = {"yext_canceled": False, "yext_suppressed": False, **columns}
+    store = models.LocalStore(name=slug.title(), slug=slug, address1="1 Main St", city="New York", state="NY",
+                              zip="10010", phone="2125551234", country="US", latitude=latitude,
+                              longitude=longitude, **columns)
+    db.add(store)
+    db.commit()
+    return store
+
+
+def test_export_matches_details(client, db):
+    store = add_store(db, "joes-pizza", 40.7128, -74.006)
+
+    details = client.get("/details", params={"storeID": store.id}).json()
+    exported = [json.loads(line) for line in client.get("/export").text.splitlines()]
+
+    assert exported == [details]
+    assert isinstance(exported[0]["latitude"], float)
+
+
+def test_geo_search_paths_return_the_same_stores(client, db, monkeypatch):
+    add_store(db, "joes-pizza", 40.7128, -74.006)
+    add_store(db, "corner-deli", 40.7306, -73.9866)
+    add_store(db, "far-away", 41.8781, -87.6298)
+    add_store(db, "closed-bakery", 40.7150, -74.008, date_deleted=datetime.now())
+    add_store(db, "suppressed-salon", 40.7200, -74.000, date_deleted=datetime.now(), yext_suppressed=True)
+    add_store(db, "flagged-books", 40.7190, -74.001, yext_suppressed=True)
+
+    def search():
+        return client.get("/search", params={"latlng": "40.7128,-74.006", "radius": 5}).json()
+
+    index = StoreGeoIndex(cell_degrees=0.25)
+    monkeypatch.setattr(api_yext, "geo_index", index)
+    from_sql = search()
+
+    index.refresh()
+    from_index = search()
+
+    assert [store["name"] for store in from_sql] == ["Joes-Pizza", "Corner-Deli"]
+    assert [store["id"] for store in from_index] == [store["id"] for store in from_sql]
+    for indexed, queried in zip(from_index, from_sql):
+        assert abs(indexed["distance_miles"] - queried["distance_miles"]) < 0.01
+
+
+def test_search_rejects_non_positive_radius(client, db):
+    for radius in (0, -5):
+        response = client.get("/search", params={"latlng": "40.7128,-74.006", "radius": radius})
+        assert response.status_code == 409
+        assert response.json()["issues"][0]["field"] == "radius"
+
+
+def export_ids(client, **params):
+    return [json.loads(line)["id"] for line in client.get("/export", params=params).text.splitlines()]
+
+
+def test_export_includes_every_status(client, db):
+    active = add_store(db, "active-store", 40.7128, -74.006, yext_id=1)
+    suppressed = add_store(db, "suppressed-store", 40.7128, -74.006, yext_id=2)
+    canceled = add_store(db, "canceled-store", 40.7128, -74.006, yext_id=3)
+
+    assert client.post("/powerlistings/suppress", json={"listingId": str(suppressed.id), "suppress": True}).status_code == 200
+    assert client.delete(f"/powerlistings/{canceled.id}").status_code == 200
+
+    assert export_ids(client, status="ACTIVE") == [active.id]
+    assert export_ids(client, status="SUPPRESSED") == [suppressed.id]
+    assert export_ids(client, status="AVAILABLE") == [canceled.id]
+    assert export_ids(client) == [active.id, suppressed.id, canceled.id]
+    assert export_ids(client, include_deleted=False) == [active.id]
+
+
+def test_nearest_paths_return_the_same_stores(client, db, monkeypatch):
+    add_store(db, "joes-pizza", 40.7128, -74.006)
+    add_store(db, "corner-deli", 40.7306, -73.9866)
+    add_store(db, "uptown-books", 40.7831, -73.9712)
+    add_store(db, "far-away", 41.8781, -87.6298)
+    add_store(db, "closed-bakery", 40.7130, -74.006, date_deleted=datetime.now())
+
+    def nearest():
+        return client.get("/nearest", params={"latlng": "40.7128,-74.006", "limit": 2}).json()
+
+    index = StoreGeoIndex(cell_degrees=0.25)
+    monkeypatch.setattr(api_yext, "geo_index", index)
+    from_sql = nearest()
+
+    index.refresh()
+    from_index = nearest()
+
+    assert [store["name"] for store in from_sql] == ["Joes-Pizza", "Corner-Deli"]
+    assert [store["id"] for store in from_index] == [store["id"] for store in from_sql]
+
+
+def order_payload(yext_id, name="Joe's Pizza", city="New York", zip="10010"):
+    return {
+        "yextId": str(yext_id),
+        "name": name,
+        "address": {"address": "1 Main St", "city": city, "visible": True, "state": "NY", "postalCode": zip,
+                    "countryCode": "US"},
+        "phones": [{"number": {"number": "2125551234"}, "type": "MAIN"}],
+        "categories": [{"id": "1", "name": "Pizza"}],
+        "description": "Pizza by the slice",
+        "geoData": {"displayLatitude": "40.7128", "displayLongitude": "-74.006"},
+    }
+
+
+def test_batch_insert_does_not_purge_the_response_cache(client, db, monkeypatch):
+    purged = []
+    monkeypatch.setattr(api_yext.response_cache, "purge", lambda *paths: purged.append(paths))
+
+    response = client.post("/powerlistings/order/batch", json=[order_payload(i, name=f"Store {i}") for i in range(5)])
+
+    assert [result["id"] is not None for result in response.json()] == [True] * 5
+    assert purged == []
+
+
+def test_order_retries_with_the_next_slug_after_a_collision(client, db, monkeypatch):
+    first = client.post("/powerlistings/order", json=order_payload(1)).json()
+    second = client.post("/powerlistings/order", json=order_payload(2)).json()
+
+    # the first lookup misses the two slugs above, like a concurrent order committing in between
+    generate = api_yext.generate_local_slug
+    calls = []
+
+    def stale_generate(db, store):
+        calls.append(store.name)
+        return api_yext.base_local_slug(store) if len(calls) == 1 else generate(db, store)
+
+    monkeypatch.setattr(api_yext, "generate_local_slug", stale_generate)
+    third = client.post("/powerlistings/order", json=order_payload(3)).json()
+
+    assert len(calls) == 2
+    assert first["url"].endswith("/joe-s-pizza-new-york-10010")
+    assert second["url"].endswith("/joe-s-pizza-new-york-10010-1")
+    assert third["url"].endswith("/joe-s-pizza-new-york-10010-2")
+
+
+def test_update_keeps_the_slug_unless_name_city_or_zip_change(client, db):
+    client.post("/powerlistings/order", json=order_payload(1))
+    listing = client.post("/powerlistings/order", json=order_payload(2)).json()
+    assert listing["url"].endswith("/joe-s-pizza-new-york-10010-1")
+
+    # the base slug is free again, but an unchanged listing must not move
+    db.query(models.LocalStore).filter(models.LocalStore.yext_id == 1).delete()
+    db.commit()
+
+    update = {**order_payload(2), "description": "Now with delivery"}
+    response = client.put(f"/powerlistings/{listing['id']}", json=update).json()
+    assert response["url"] == listing["url"]
+
+    response = client.put(f"/powerlistings/{listing['id']}", json={**update, "name": "Joe's Slices"}).json()
+    assert response["url"].endswith("/joe-s-slices-new-york-10010")
+
+
+def test_batch_reports_a_status_per_item(client, db):
+    client.post("/powerlistings/order", json=order_payload(1, name="Existing Store"))
+    invalid = order_payload(3, name="No Phone")
+    invalid["phones"] = []
+
+    results = client.post("/powerlistings/order/batch", json=[
+        order_payload(2, name="New Store"),
+        invalid,
+        order_payload(1, name="Existing Again"),
+        order_payload(2, name="Repeated In Batch"),
+        order_payload(4, name="Another Store"),
+    ]).json()
+
+    assert results[0]["url"].endswith("/new-store-new-york-10010")
+    assert results[1]["status"] == "REJECTED"
+    assert results[1]["issues"][0]["field"] == "phones"
+    assert results[2] == {"error": {"message": api_yext.DUPLICATE_YEXT_ID}}
+    assert results[3] == {"error": {"message": api_yext.DUPLICATE_YEXT_ID}}
+    assert results[4]["url"].endswith("/another-store-new-york-10010")
+    assert db.query(models.LocalStore).count() == 3
+
+
+def test_batch_accepts_ndjson(client, db):
+    body = "\n".join([json.dumps(order_payload(1, name="First Store")), "{not json",
+                      "", json.dumps(order_payload(2, name="Second Store"))])
+
+    results = client.post("/powerlistings/order/batch", content=body,
+                          headers={"content-type": "application/x-ndjson"}).json()
+
+    assert len(results) == 3
+    assert results[0]["url"].endswith("/first-store-new-york-10010")
+    assert results[1] == {"status": "REJECTED", "issues": [{"description": "invalid JSON", "field": ""}]}
+    assert results[2]["url"].endswith("/second-store-new-york-10010")
@@ -0,0 +1,52 @@
+from app.geo_index import StoreGeoIndex, import_numpy
+from app.util import haversine_miles
+import random
+import time
+
+QUERIES = [(40.7128, -74.006), (61.2, -149.9), (21.3, -157.8), (-33.9, 151.2), (0, 0)]
+
+
+def build_index(count=3000):
+    import_numpy()
+    random.seed(7)
+    index = StoreGeoIndex(cell_degrees=0.25)
+    points = {}
+    for store_id in range(1, count + 1):
+        lat, lng = random.uniform(25, 49), random.uniform(-124, -67)
+        index.put(store_id, lat, lng)
+        points[store_id] = (lat, lng)
+    return index, points
+
+
+def brute_force(points, lat, lng, k, max_radius_miles=None):
+    hits = sorted((haversine_miles(lat, lng, p_lat, p_lng), store_id) for store_id, (p_lat, p_lng) in points.items())
+    if max_radius_miles is not None:
+        hits = [hit for hit in hits if hit[0] <= max_radius_miles]
+    return hits[:k]
+
+
+def assert_same(hits, expected):
+    assert [store_id for _, store_id in hits] == [store_id for _, store_id in expected]
+    for (distance, _), (expected_distance, _) in zip(hits, expected):
+        assert abs(distance - expected_distance) < 1e-6
+
+
+def test_nearest_matches_brute_force():
+    index, points = build_index()
+    for lat, lng in QUERIES:
+        for k in (1, 10):
+            assert_same(index.nearest(lat, lng, k), brute_force(points, lat, lng, k))
+
+
+def test_nearest_respects_max_radius():
+    index, points = build_index()
+    for lat, lng in QUERIES:
+        assert_same(index.nearest(lat, lng, 10, max_radius_miles=50), brute_force(points, lat, lng, 10, 50))
+
+
+def test_nearest_far_from_the_data_is_fast():
+    index, _ = build_index()
+    start = time.perf_counter()
+    for lat, lng in [(61.2, -149.9), (21.3, -157.8)]:
+        index.nearest(lat, lng, 10)
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,23 @@
+from sqlalchemy import select
+from app import models
+from app.db import AsyncSessionLocal
+from app.schemas.yext import YextData, YextEmail, YextImage
+import asyncio
+
+
+def test_listing_options_load_yext_properties_on_async_session(db):
+    store = models.LocalStore(name="Joe's Pizza", slug="joes-pizza", address1="1 Main St", city="New York",
+                              state="NY", zip="10010", phone="2125551234", yext_canceled=False,
+                              yext_suppressed=False)
+    store.yext = YextData(emails=[YextEmail(address="joe@example.com")], payment_options=["VISA"],
+                          images=[YextImage(url="https://images.example.com/1.jpg", type="GALLERY")])
+    db.add(store)
+    db.commit()
+
+    async def load():
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(models.LocalStore).options(*models.LocalStore.listing_options()))
+            store = result.scalars().one()
+            return [email.address for email in store.emails], store.payment_options, len(store.gallery_images), store.videos
+
+    assert asyncio.run(load()) == (["joe@example.com"], ["VISA"], 1, [])
@@ -0,0 +1,21 @@
+from app import models, pages
+from app.db import AsyncSessionLocal
+import asyncio
+
+
+def test_catch_all_lookup_does_not_cache_misses(db):
+    db.add(models.Page(path="/about", title="About", content="About us"))
+    db.commit()
+    pages.invalidate()
+
+    async def lookup(path, **kwargs):
+        async with AsyncSessionLocal() as session:
+            return await pages.find_page_async(session, path, **kwargs)
+
+    assert asyncio.run(lookup("/about", cache_missing=False)).title == "About"
+    assert asyncio.run(lookup("/wp-login.php", cache_missing=False)) is None
+    assert pages.page_cache.get("/about").title == "About"
+    assert pages.page_cache.get("/wp-login.php", "unset") == "unset"
+
+    assert asyncio.run(lookup("/events")) is None
+    assert pages.page_cache.get("/events", "unset") is None
@@ -0,0 +1,54 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from app.response_cache import ResponseCache, ResponseCacheMiddleware, cache_response
+import asyncio
+import httpx
+
+CHUNKS = [b"<html>", b"<p>streamed</p>", b"</html>"]
+
+
+def streamed_app():
+    app = FastAPI()
+    cache = ResponseCache(max_bytes=1024 * 1024)
+    renders = []
+
+    @app.get("/stores/local/{slug}")
+    @cache_response(ttl=60, stale_ttl=300)
+    async def get_local_store(request: Request, slug: str):
+        renders.append(slug)
+
+        async def body():
+            for chunk in CHUNKS:
+                yield chunk
+
+        return StreamingResponse(body(), media_type="text/html")
+
+    return ResponseCacheMiddleware(app, cache=cache), cache, renders
+
+
+def test_revalidates_stale_streamed_route():
+    middleware, cache, renders = streamed_app()
+
+    async def run():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/stores/local/joe")
+            assert response.headers["x-cache"] == "MISS"
+            assert response.content == b"".join(CHUNKS)
+
+            (key, entry), = cache._data.items()
+            entry.stored_at -= 120
+
+            response = await client.get("/stores/local/joe")
+            assert response.headers["x-cache"] == "STALE"
+            assert middleware._revalidating
+
+            # the disconnect listener of the streamed response must wait, not spin on receive()
+            await asyncio.wait_for(asyncio.gather(*middleware._revalidating.values()), timeout=5)
+
+            response = await client.get("/stores/local/joe")
+            assert response.headers["x-cache"] == "HIT"
+            assert response.content == b"".join(CHUNKS)
+
+    asyncio.run(run())
+    assert renders == ["joe", "joe"]
@@ -0,0 +1,97 @@
+from fastapi.testclient import TestClient
+from app import models, pages
+from app.main import app
+from app.routes import web
+from app.search import StoreSearchIndex
+from app.timing import request_seconds
+import pytest
+
+
+@pytest.fixture
+def client(db):
+    db.add(models.Page(path="/", title="Home", content=""))
+    db.commit()
+    return TestClient(app)
+
+
+def add_store(db, name, state):
+    db.add(models.LocalStore(name=name, slug=name.lower().replace(" ", "-"), address1="1 Main St", city="Bench",
+                             state=state, zip="10010", phone="2125551234", yext_canceled=False,
+                             yext_suppressed=False))
+    db.commit()
+
+
+def test_search_is_not_limited_to_the_fallback_state(client, db, monkeypatch):
+    add_store(db, "Austin Pizza", "TX")
+    add_store(db, "Brooklyn Pizza", "NY")
+    index = StoreSearchIndex()
+    index.refresh()
+    monkeypatch.setattr(web, "search_index", index)
+
+    body = client.get("/search", params={"keywords": "pizza"}).text
+
+    assert "[Austin Pizza]" in body
+    assert "[Brooklyn Pizza]" in body
+
+
+def test_unknown_deal_and_holiday_slugs_are_not_cached(client):
+    pages.invalidate()
+
+    assert client.get("/deals/no-such-deal").status_code == 404
+    assert client.get("/holidays/no-such-holiday").status_code == 404
+
+    assert pages.page_cache.get("/deals/no-such-deal", "unset") == "unset"
+    assert pages.page_cache.get("/holidays/no-such-holiday", "unset") == "unset"
+
+
+def test_store_update_purges_the_cached_page(client, db):
+    db.add(models.Page(path="/stores/local/{slug}", title="Store", content=""))
+    db.commit()
+    order = {
+        "yextId": "1", "name": "Joe's Pizza", "description": "Pizza by the slice",
+        "address": {"address": "1 Main St", "city": "New York", "visible": True, "state": "NY",
+                    "postalCode": "10010", "countryCode": "US"},
+        "phones": [{"number": {"number": "2125551234"}, "type": "MAIN"}],
+        "geoData": {"displayLatitude": "40.7128", "displayLongitude": "-74.006"},
+    }
+    listing = client.post("/api/yext/powerlistings/order", json=order).json()
+    path = "/stores/local/joe-s-pizza-new-york-10010"
+
+    assert client.get(path).headers["x-cache"] == "MISS"
+    cached = client.get(path)
+    assert cached.headers["x-cache"] == "HIT"
+    assert client.get(path, headers={"if-none-match": cached.headers["etag"]}).status_code == 304
+
+    client.put(f"/api/yext/powerlistings/{listing['id']}", json={**order, "description": "Now with delivery"})
+
+    response = client.get(path)
+    assert response.headers["x-cache"] == "MISS"
+    assert "Now with delivery" in response.text
+
+    # the store page streams, so the new ETag comes with the first cached copy
+    revalidated = client.get(path, headers={"if-none-match": cached.headers["etag"]})
+    assert revalidated.status_code == 200
+    assert revalidated.headers["x-cache"] == "HIT"
+    assert revalidated.headers["etag"] != cached.headers["etag"]
+
+
+def test_cache_hits_are_timed_under_their_route(client, db):
+    db.add(models.Page(path="/deals/pizza", title="Pizza deals", content=""))
+    db.commit()
+
+    for _ in range(3):
+        client.get("/deals/pizza")
+    assert client.get("/deals/pizza").headers["x-cache"] == "HIT"
+
+    samples = dict(sample for sample in request_seconds.samples())
+    count = 'http_request_duration_seconds_count{method="GET",route="/deals/{category_slug}",status="200"}'
+    assert samples[count] >= 4
+
+
+def test_cache_stats_on_metrics(client):
+    lines = client.get("/metrics").text.splitlines()
+
+    assert "# TYPE cache_size gauge" in lines
+    assert "# TYPE cache_hits_total counter" in lines
+    assert "# TYPE cache_misses_total counter" in lines
+    assert any(line.startswith('cache_hits_total{cache="pages"} ') for line in lines)
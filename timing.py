@@ -0,0 +1,102 @@
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.settings import settings
+from app import metrics
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+request_seconds = metrics.Histogram("http_request_duration_seconds", "Time to handle a request, by route")
+request_queries = metrics.Histogram("db_queries_per_request", "SQL statements executed per request",
+                                    buckets=QUERY_COUNT_BUCKETS)
+request_sql_seconds = metrics.Histogram("db_sql_seconds_per_request", "Time spent executing SQL per request")
+n_plus_one_requests = metrics.Counter("db_n_plus_one_requests_total",
+                                      "Requests that repeated one SQL statement at least n_plus_one_threshold times")
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+
+
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_stats", default=None)
+
+
+# every engine, including the async engines' sync_engine and the replicas
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(connection, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_query(connection, cursor, statement, parameters, context, executemany):
+    stats = current_stats.get()
+    if stats is None:
+        return
+
+    stats.queries += 1
+    stats.sql_seconds += time.perf_counter() - context._query_start
+    stats.statements[statement] += 1
+
+
+def route_name(scope):
+    route = scope.get("route")
+    if route is None:
+        # responses served from the response cache never reach the router, it keeps their route
+        cached_route = scope.get("state", {}).get("cached_route")
+        return cached_route or scope.get("root_path") or "unmatched"
+
+    return scope.get("root_path", "") + route.path
+
+
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.server_timing_enabled:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    header = 'app;dur=%.1f, db;dur=%.1f;desc="%d queries"' % (
+                        elapsed, stats.sql_seconds * 1000, stats.queries)
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            current_stats.reset(token)
+            self.record(scope, stats, time.perf_counter() - start, status)
+
+    def record(self, scope, stats: RequestStats, elapsed: float, status: int):
+        route = route_name(scope)
+        request_seconds.observe(elapsed, route=route, method=scope["method"], status=str(status))
+        request_queries.observe(stats.queries, route=route)
+        request_sql_seconds.observe(stats.sql_seconds, route=route)
+
+        if stats.statements:
+            statement, count = stats.statements.most_common(1)[0]
+            if count >= settings.n_plus_one_threshold:
+                n_plus_one_requests.inc(route=route)
+                logger.warning("Possible N+1 on %s: statement ran %d times: %s", route, count, statement[:200])
@@ -1,4 +1,52 @@
 from jinja2 import Environment, BaseLoader
+from threading import Event, Thread
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_MILES = 3958.8
+
 
 def phone_format(n):
     return format(int(n[:-1]), ",").replace(",", "-") + n[-1]
+
+
+def normalize_phone(n):
+    if not n:
+        return None
+
+    digits = re.sub(r"\D", "", n)
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+
+    return digits or None
+
+
+def normalize_name(name):
+    if not name:
+        return None
+
+    return " ".join(name.split()).casefold()
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+# runs fn every `seconds` on a daemon thread until the returned event is set
+def every(seconds: float, fn) -> Event:
+    stop = Event()
+
+    def run():
+        while not stop.wait(seconds):
+            try:
+                fn()
+            except Exception:
+                logger.exception("Periodic task %s failed", getattr(fn, "__qualname__", fn))
+
+    Thread(target=run, daemon=True).start()
+    return stop